@@ -1,10 +1,57 @@
+import argparse
+import hashlib
+import itertools
 import os
 import subprocess
 import shutil
+import struct
 import json
 import sys
-import time
 import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from fractions import Fraction
+from queue import Queue
+
+try:
+    # Optional: PyAV reads container metadata in-process, avoiding one ffprobe
+    # process launch per file. Install with `pip install av`.
+    import av
+except ImportError:
+    av = None
+
+try:
+    # Optional: orjson parses ffprobe output and the state files straight from
+    # bytes, several times faster than the json module.
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Optional: pynvml lists GPUs without launching nvidia-smi.
+    import pynvml
+except ImportError:
+    pynvml = None
+
+try:
+    # Optional: NVIDIA's Video Processing Framework, for ENGINE = "vpf".
+    import numpy as np
+    import PyNvCodec as nvc
+except ImportError:
+    nvc = None
+
+try:
+    # Optional: xxhash fingerprints files for the manifest faster than hashlib.
+    import xxhash
+except ImportError:
+    xxhash = None
 
 # --- Main Configuration ---
 
@@ -17,7 +64,7 @@ FFMPEG_PATH = "ffmpeg"
 #    "balanced": Good mix of quality and size (Single Pass).
 #    "best_for_size": Aggressive compression (Single Pass).
 #    "extreme_720p": Maximum compression, downscales video (Single Pass).
-#    "best_quality_at_size": Uses 2-Pass VBR for best quality at a target size.
+#    "best_quality_at_size": Uses NVENC multipass VBR for best quality at a target size.
 SELECTED_PRESET = "best_quality_at_size"
 
 # 3. TARGET BITRATE (for "best_quality_at_size" preset ONLY)
@@ -27,382 +74,1751 @@ TARGET_BITRATE_KBPS = 2300
 MINIMUM_COMPRESSION_PERCENT = 10
 
 
+# 5. CONCURRENT ENCODES (NVENC SESSIONS)
+# NVENC is a dedicated encoder block, separate from the CUDA cores, and a single
+# 720p/1080p session rarely keeps it busy. Running a few encodes at once fills
+# it up; lower this to 1 if your GPU rejects extra sessions. The limit is per
+# GPU: with several GPUs, each encode goes to a GPU with a free session.
+NVENC_CONCURRENCY = 2
+
+# 6. PARALLEL JOBS
+# Files processed at once. Jobs beyond NVENC_CONCURRENCY handle copies and
+# remuxes while the encoder sessions are busy. Override with --jobs.
+MAX_JOBS = 4
+
+# 7. ENCODING ENGINE
+# "ffmpeg" launches one ffmpeg process per encode. "vpf" decodes and encodes
+# in-process with NVIDIA's Video Processing Framework (PyNvCodec), skipping
+# ffmpeg's per-file CUDA/NVENC startup; ffmpeg then only muxes in the audio.
+# Sources VPF can't take as-is (scaling, non-4:2:0) still go through ffmpeg.
+# Override with --engine.
+ENGINE = "ffmpeg"
+
+
 # --- Script Settings (DO NOT CHANGE) ---
 INPUT_FOLDER = "input"
 OUTPUT_FOLDER = "output"
 VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv", ".wmv", ".m4v")
+# Lowercased set for O(1) lookups of a file's extension.
+VIDEO_EXT_SET = frozenset(ext.lower() for ext in VIDEO_EXTENSIONS)
 AUDIO_CODEC = "copy"
+# Audio codecs that can be copied into an .mp4 as-is. Anything else (Opus,
+# Vorbis, FLAC, PCM, ...) is re-encoded to AAC when AUDIO_CODEC is "copy".
+MP4_AUDIO_CODECS = frozenset({"aac", "mp3", "ac3", "eac3", "alac"})
+# NVDEC (CUVID) decoders by source codec. Sources decoded by one of these stay in
+# GPU memory all the way through scale_cuda and NVENC.
+CUVID_DECODERS = {
+    "h264": "h264_cuvid",
+    "hevc": "hevc_cuvid",
+    "vp9": "vp9_cuvid",
+    "mpeg2video": "mpeg2_cuvid",
+}
+# Pixel formats NVDEC can decode: 4:2:0 only, and 10-bit only for HEVC and VP9.
+# Anything else (e.g. H.264 4:2:2/High10 camera footage) is left to ffmpeg's
+# -hwaccel cuda, which falls back to software decoding.
+NVDEC_8BIT_PIX_FMTS = frozenset({"yuv420p", "yuvj420p", "nv12"})
+NVDEC_10BIT_PIX_FMTS = frozenset({"yuv420p10le", "p010le"})
+NVDEC_10BIT_CODECS = frozenset({"hevc", "vp9"})
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+# Learned CQ output bits per pixel, kept in the output folder between runs.
+SIZE_ESTIMATES_FILE = ".size_estimates.json"
+# Per-input probe results, fingerprints and outcomes, reused on later runs.
+MANIFEST_FILE = ".manifest.json"
+# Bytes hashed from each end of a file to tell a touched file from a changed one.
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+# Encodes needed for a CQ preset/codec pair before its estimate is trusted.
+SIZE_ESTIMATE_MIN_SAMPLES = 3
+# The estimate is a running mean over roughly this many recent encodes, so it
+# follows changes in the library instead of being fixed by early files.
+SIZE_ESTIMATE_WINDOW = 20
+# Every Nth file predicted to miss the minimum reduction is encoded anyway, so
+# the estimate keeps getting samples and a wrong prediction can recover.
+SIZE_ESTIMATE_RESAMPLE_EVERY = 10
+# With --batch-clips, clips up to this length that share codec, resolution,
+# pixel format and frame rate are encoded together by one ffmpeg process.
+BATCH_CLIP_MAX_SECONDS = 30
+BATCH_MAX_CLIPS = 50
+# How far a split-out clip's duration may drift from its source before the
+# batch is discarded and its clips are encoded one by one.
+BATCH_DURATION_TOLERANCE = 0.5
 
 # --- Quality Preset Definitions ---
 QUALITY_PRESETS = {
-    "best_quality_at_size": {"MODE": "VBR", "GPU_PRESET": "p7", "SCALE": None},
+    "best_quality_at_size": {
+        "MODE": "VBR",
+        # p5 with -tune hq, lookahead and stronger AQ comes close to p7 quality
+        # at roughly 1.6x the speed.
+        "GPU_PRESET": "p5",
+        "TUNE": "hq",
+        "SCALE": None,
+        "AQ": True,
+        "AQ_STRENGTH": 8,
+        "LOOKAHEAD": 32,
+    },
     "best_for_quality": {
         "MODE": "CQ",
         "H265_CQ": 23,
         "GPU_PRESET": "p5",
         "SCALE": None,
+        "AQ": True,
+        "LOOKAHEAD": 32,
+    },
+    "balanced": {
+        "MODE": "CQ",
+        "H265_CQ": 28,
+        "GPU_PRESET": "p6",
+        "SCALE": None,
+        "AQ": False,
+        "LOOKAHEAD": 0,
+    },
+    "best_for_size": {
+        "MODE": "CQ",
+        "H265_CQ": 32,
+        "GPU_PRESET": "p6",
+        "SCALE": None,
+        "AQ": False,
+        "LOOKAHEAD": 0,
     },
-    "balanced": {"MODE": "CQ", "H265_CQ": 28, "GPU_PRESET": "p6", "SCALE": None},
-    "best_for_size": {"MODE": "CQ", "H265_CQ": 32, "GPU_PRESET": "p6", "SCALE": None},
     "extreme_720p": {
         "MODE": "CQ",
         "H265_CQ": 35,
         "GPU_PRESET": "p4",
         "SCALE": "-1:720",
+        "AQ": False,
+        "LOOKAHEAD": 0,
     },
 }
 
 config = QUALITY_PRESETS[SELECTED_PRESET]
 
+# CPUs local to each GPU (None when unknown), indexed like CUDA devices
+# ordered by PCI bus ID. Filled in by detect_gpus() at startup.
+gpu_cpusets = [None]
+# Set on Ctrl+C so queued workers stop instead of starting new encodes.
+stop_requested = threading.Event()
+
+# Serializes console output from concurrent encode/finalize threads.
+print_lock = threading.Lock()
+
+
+# Running (ratio sum, sample count) per CQ preset and source codec.
+size_estimates = {}
+size_estimates_lock = threading.Lock()
+# Predicted skips per estimate key since the last forced sample.
+predicted_skips = {}
+
+
+def log(message):
+    """Prints a message without interleaving it with other threads' output."""
+    with print_lock:
+        print(message)
+
+
+def parse_json(data):
+    """Parses JSON bytes with orjson when available, else the json module."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_json_file(path):
+    """Loads a JSON state file from a previous run, or {} if there isn't one."""
+    try:
+        with open(path, "rb") as f:
+            return parse_json(f.read())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_json_file(path, data):
+    """Writes a JSON state file for the next run."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def load_size_estimates(path):
+    """Loads the size estimates learned on previous runs."""
+    # Older files hold size ratios under other keys; those are dropped.
+    size_estimates.update(
+        (key, value)
+        for key, value in load_json_file(path).items()
+        if key.startswith("bpp/")
+    )
+
+
+def save_size_estimates(path):
+    """Persists the learned size estimates for the next run."""
+    with size_estimates_lock:
+        data = dict(size_estimates)
+    save_json_file(path, data)
+
+
+def size_estimate_key(preset_config, codec):
+    """Identifies the CQ settings and source codec an estimate applies to."""
+    key = f"bpp/cq{preset_config['H265_CQ']}"
+    if preset_config.get("SCALE"):
+        key += f"@{preset_config['SCALE']}"
+    return f"{key}/{codec or 'unknown'}"
+
+
+def pixel_rate(file_details):
+    """Source pixels per second, or 0 if resolution or frame rate is unknown."""
+    try:
+        fps = Fraction(file_details.get("frame_rate") or 0)
+    except (ValueError, ZeroDivisionError):
+        return 0
+    return (file_details.get("width") or 0) * (file_details.get("height") or 0) * fps
+
+
+def record_size_sample(preset_config, file_details, output_size):
+    """
+    Adds one CQ encode to the estimates as output bits per source pixel, which
+    unlike a size ratio doesn't depend on how heavily the source was coded.
+    """
+    if preset_config["MODE"] != "CQ":
+        return
+    pixels = pixel_rate(file_details) * Fraction(file_details["duration"] or 0)
+    if not pixels:
+        return
+    bpp = float(output_size * 8 / pixels)
+    key = size_estimate_key(preset_config, file_details["codec"])
+    with size_estimates_lock:
+        mean, count = size_estimates.get(key, (0.0, 0))
+        mean += (bpp - mean) / min(count + 1, SIZE_ESTIMATE_WINDOW)
+        size_estimates[key] = (mean, count + 1)
+
+
+def estimate_output_size(file_details, input_size, preset_config):
+    """Predicts the encoded size in bytes, or None when there's no basis for it."""
+    if preset_config["MODE"] == "VBR":
+        if not file_details["duration"]:
+            return None
+        return TARGET_BITRATE_KBPS * 1000 / 8 * file_details["duration"]
+
+    pixels = pixel_rate(file_details) * Fraction(file_details["duration"] or 0)
+    if not pixels:
+        return None
+    key = size_estimate_key(preset_config, file_details["codec"])
+    with size_estimates_lock:
+        mean, count = size_estimates.get(key, (0.0, 0))
+    if count < SIZE_ESTIMATE_MIN_SAMPLES:
+        return None
+    return mean * float(pixels) / 8
+
+
+def resample_due(file_details, preset_config):
+    """Counts a predicted skip; True when this one should be encoded as a sample."""
+    if preset_config["MODE"] != "CQ":
+        return False
+    key = size_estimate_key(preset_config, file_details["codec"])
+    with size_estimates_lock:
+        skips = predicted_skips.get(key, 0) + 1
+        predicted_skips[key] = skips % SIZE_ESTIMATE_RESAMPLE_EVERY
+    return skips >= SIZE_ESTIMATE_RESAMPLE_EVERY
+
+
+def video_details(
+    codec=None,
+    bit_rate=0,
+    total_frames=0,
+    duration=0.0,
+    pix_fmt=None,
+    width=0,
+    height=0,
+    frame_rate=None,
+    audio_codec=None,
+    r_frame_rate=None,
+    rotation=0,
+):
+    """Builds the details dict returned by the probe functions."""
+    return {
+        "codec": codec,
+        "bit_rate": bit_rate,
+        "total_frames": total_frames,
+        "duration": duration,
+        "pix_fmt": pix_fmt,
+        "width": width,
+        "height": height,
+        "frame_rate": frame_rate,
+        "audio_codec": audio_codec,
+        "r_frame_rate": r_frame_rate,
+        "rotation": rotation,
+    }
+
+
+def constant_frame_rate(file_details):
+    """True when the stream's base frame rate matches its average frame rate."""
+    try:
+        return Fraction(file_details.get("r_frame_rate") or 0) == Fraction(
+            file_details.get("frame_rate") or 0
+        )
+    except (ValueError, ZeroDivisionError):
+        return False
+
+
+def pyav_rotation(stream):
+    """Display matrix rotation in degrees, from side data or the old rotate tag."""
+    side_data = getattr(stream, "side_data", None) or {}
+    if "DISPLAYMATRIX" in side_data:
+        return float(side_data["DISPLAYMATRIX"])
+    try:
+        return -float(stream.metadata.get("rotate", 0))
+    except ValueError:
+        return 0
+
+
+def get_video_details_pyav(file_path):
+    """Uses PyAV to get the same details as get_video_details without ffprobe."""
+    try:
+        with av.open(file_path, metadata_errors="ignore") as container:
+            if not container.streams.video:
+                return video_details()
+            stream = container.streams.video[0]
+
+            codec = stream.codec_context.name
+            pix_fmt = stream.codec_context.pix_fmt
+            bit_rate = stream.bit_rate or container.bit_rate or 0
+            total_frames = stream.frames
+            duration = (
+                float(stream.duration * stream.time_base)
+                if stream.duration and stream.time_base
+                else (container.duration or 0) / av.time_base
+            )
+
+            if total_frames == 0 and duration and stream.average_rate:
+                total_frames = int(duration * stream.average_rate)
+
+            return video_details(
+                codec,
+                bit_rate,
+                total_frames,
+                duration,
+                pix_fmt,
+                stream.codec_context.width,
+                stream.codec_context.height,
+                str(stream.average_rate) if stream.average_rate else None,
+                (
+                    container.streams.audio[0].codec_context.name
+                    if container.streams.audio
+                    else None
+                ),
+                str(stream.base_rate) if stream.base_rate else None,
+                pyav_rotation(stream),
+            )
+    except (av.error.FFmpegError, ZeroDivisionError):
+        return video_details()
+
+
+def ffprobe_rotation(stream):
+    """Display matrix rotation in degrees, from side data or the old rotate tag."""
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return float(side_data["rotation"])
+    try:
+        return -float(stream.get("tags", {}).get("rotate", 0))
+    except ValueError:
+        return 0
+
 
 def get_video_details(file_path):
-    """Uses ffprobe to get video details, with a fallback for container bitrate."""
+    """
+    Uses one ffprobe call to get video details plus the first audio codec,
+    falling back to container values.
+    """
+    if av is not None:
+        return get_video_details_pyav(file_path)
+
     ffprobe_path = FFMPEG_PATH.replace("ffmpeg", "ffprobe")
-    stream_command = [
+    command = [
         ffprobe_path,
         "-v",
         "quiet",
         "-print_format",
         "json",
         "-show_streams",
-        "-select_streams",
-        "v:0",
-        file_path,
-    ]
-    format_command = [
-        ffprobe_path,
-        "-v",
-        "quiet",
-        "-print_format",
-        "json",
         "-show_format",
         file_path,
     ]
 
     try:
         result = subprocess.run(
-            stream_command, capture_output=True, text=True, check=True, encoding="utf-8"
+            command, stdin=subprocess.DEVNULL, capture_output=True, check=True
         )
-        data = json.loads(result.stdout)
+        data = parse_json(result.stdout)
 
-        if not data.get("streams"):
-            return None, 0, 0
-        stream = data["streams"][0]
+        streams = data.get("streams", [])
+        stream = next((s for s in streams if s.get("codec_type") == "video"), None)
+        if stream is None:
+            return video_details()
+        audio_stream = next((s for s in streams if s.get("codec_type") == "audio"), {})
+        container = data.get("format", {})
 
         codec, bit_rate = stream.get("codec_name"), int(stream.get("bit_rate", 0))
-        total_frames = int(stream.get("nb_frames", 0))
-
         if bit_rate == 0:
-            format_result = subprocess.run(
-                format_command,
-                capture_output=True,
-                text=True,
-                check=True,
-                encoding="utf-8",
-            )
-            format_data = json.loads(format_result.stdout)
-            bit_rate = int(format_data.get("format", {}).get("bit_rate", 0))
+            bit_rate = int(container.get("bit_rate", 0))
+        total_frames = int(stream.get("nb_frames", 0))
+        try:
+            duration = float(stream.get("duration") or container.get("duration", 0))
+        except ValueError:
+            duration = 0.0
 
         if total_frames == 0:
-            duration_str, fr_str = stream.get("duration", "0"), stream.get(
-                "avg_frame_rate", "0/1"
-            )
-            if "/" in fr_str and duration_str != "0":
+            fr_str = stream.get("avg_frame_rate", "0/1")
+            if "/" in fr_str and duration:
                 try:
-                    duration, (num, den) = float(duration_str), map(
-                        int, fr_str.split("/")
-                    )
+                    num, den = map(int, fr_str.split("/"))
                     if den != 0:
                         total_frames = int(duration * (num / den))
                 except (ValueError, ZeroDivisionError):
                     total_frames = 0
 
-        return codec, bit_rate, total_frames
+        return video_details(
+            codec,
+            bit_rate,
+            total_frames,
+            duration,
+            stream.get("pix_fmt"),
+            stream.get("width", 0),
+            stream.get("height", 0),
+            stream.get("avg_frame_rate"),
+            audio_stream.get("codec_name"),
+            stream.get("r_frame_rate"),
+            ffprobe_rotation(stream),
+        )
 
     except FileNotFoundError:
-        print(
+        log(
             f"\n[FATAL ERROR] Cannot find ffprobe. Please check the FFMPEG_PATH variable."
         )
         sys.exit(1)
     except (subprocess.CalledProcessError, json.JSONDecodeError, IndexError):
-        return None, 0, 0
+        return video_details()
+
+
+def print_progress_complete(description, bar_length=40):
+    """Prints the finished state of a progress bar."""
+    bar = "█" * bar_length
+    progress_text = f"{description}: |{bar}| 100.0% (Complete)"
+    with print_lock:
+        sys.stdout.write(f"\r{progress_text.ljust(80)}\n")
+        sys.stdout.flush()
+
 
+def print_progress(description, current_frame, total_frames, bar_length=40):
+    """Redraws the progress bar line for current_frame out of total_frames."""
+    percent = (current_frame / total_frames) * 100
+    filled_length = int(bar_length * current_frame // total_frames)
+    bar = "█" * filled_length + "-" * (bar_length - filled_length)
 
-def monitor_ffmpeg_progress(process, total_frames, progress_file_path, description):
+    progress_text = f"{description}: |{bar}| {percent:5.1f}%"
+    with print_lock:
+        sys.stdout.write(f"\r{progress_text.ljust(80)}")
+        sys.stdout.flush()
+
+
+def monitor_ffmpeg_progress(process, total_frames, description):
     """
-    REWRITTEN: Displays a progress bar by reliably reading FFmpeg's dedicated progress file.
+    Displays a progress bar by reading FFmpeg's `-progress pipe:1` output as it arrives.
     """
     bar_length = 40
 
-    # Wait for the progress file to be created
-    while (
-        not os.path.exists(progress_file_path)
-        or os.path.getsize(progress_file_path) == 0
-    ):
-        if process.poll() is not None:
-            return  # Process ended before progress file was made
-        time.sleep(0.1)
+    if total_frames <= 0:
+        # Nothing to show a percentage against; just keep the pipe drained.
+        for _ in process.stdout:
+            pass
+        print_progress_complete(description, bar_length)
+        return
 
     last_frame = 0
-    while process.poll() is None:
-        try:
-            with open(progress_file_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-
-            progress_data = {}
-            for line in lines:
-                if "=" in line:
-                    key, value = line.strip().split("=", 1)
-                    progress_data[key] = value
-
-            if "frame" in progress_data:
-                current_frame = int(progress_data["frame"])
-                if current_frame > last_frame:
-                    last_frame = current_frame
-                    percent = (
-                        (current_frame / total_frames) * 100 if total_frames > 0 else 0
-                    )
-                    filled_length = (
-                        int(bar_length * current_frame // total_frames)
-                        if total_frames > 0
-                        else 0
-                    )
-                    bar = "█" * filled_length + "-" * (bar_length - filled_length)
+    current_frame = 0
+    for line in process.stdout:
+        # Only two keys matter, so test prefixes instead of splitting every line.
+        if line.startswith(b"frame="):
+            try:
+                current_frame = int(line[6:])
+            except ValueError:
+                pass
+            continue
 
-                    progress_text = f"{description}: |{bar}| {percent:5.1f}%"
-                    sys.stdout.write(f"\r{progress_text.ljust(80)}")
-                    sys.stdout.flush()
-        except (IOError, ValueError):
-            pass  # File might be locked, try again
+        # FFmpeg ends every progress block with a "progress=" line.
+        if not line.startswith(b"progress=") or current_frame <= last_frame:
+            continue
 
-        time.sleep(0.5)
+        last_frame = current_frame
+        print_progress(description, current_frame, total_frames, bar_length)
 
-    bar = "█" * bar_length
-    progress_text = f"{description}: |{bar}| 100.0% (Complete)"
-    sys.stdout.write(f"\r{progress_text.ljust(80)}\n")
-    sys.stdout.flush()
+    print_progress_complete(description, bar_length)
 
 
-def compress_video_gpu(input_file, output_file, total_frames, preset_config):
-    """Compresses a video using the robust -progress file method and redirects logs."""
-    progress_file_path = ""
-    log_file_path = os.path.splitext(output_file)[0] + "_ffmpeg_log.txt"
+def encoder_tuning_args(preset_config):
+    """
+    Returns the NVENC tune, adaptive-quantization and lookahead flags for a preset.
+    Spatial and temporal AQ each cost roughly 10% encoder throughput and lookahead
+    adds frame buffering, so the size-oriented presets leave them off.
+    """
+    # The maximum encoder surface pool, so lookahead and B-frames never wait on
+    # a free input surface.
+    args = ["-surfaces", "64"]
+    if preset_config.get("TUNE"):
+        args.extend(["-tune", preset_config["TUNE"]])
+    if preset_config.get("AQ"):
+        args.extend(["-spatial-aq", "1", "-temporal-aq", "1"])
+        if preset_config.get("AQ_STRENGTH"):
+            args.extend(["-aq-strength", str(preset_config["AQ_STRENGTH"])])
+    if preset_config.get("LOOKAHEAD"):
+        args.extend(["-rc-lookahead", str(preset_config["LOOKAHEAD"])])
+    return args
+
+
+def video_filter_args(preset_config, frames_on_gpu, pix_fmt):
+    """
+    Builds the -vf arguments for scaling and pixel-format conversion, or an
+    empty list when the frames can go straight to NVENC.
+    """
+    filters = []
+    # GPU-decoded frames are always 4:2:0. Other layouts come from the CPU
+    # decoder and are converted there with ffmpeg's own format filter, which
+    # works on every build, unlike scale_cuda's format option. Sources above
+    # 8 bits go to p010le so HEVC keeps their depth (Main10).
+    if (
+        not frames_on_gpu
+        and pix_fmt
+        and "420" not in pix_fmt
+        and pix_fmt not in ("nv12", "p010le")
+    ):
+        high_depth = any(depth in pix_fmt for depth in ("p10", "p12", "p14", "p16"))
+        filters.append("format=p010le" if high_depth else "format=yuv420p")
+    if preset_config.get("SCALE"):
+        if not frames_on_gpu:
+            filters.append("hwupload_cuda")
+        filters.append(f"scale_cuda={preset_config['SCALE']}")
+    if not filters:
+        return []
+    return ["-vf", ",".join(filters)]
+
+
+def drain_stream(pipe, lines):
+    """Reads a pipe until EOF, keeping only the most recent lines."""
+    for line in pipe:
+        lines.append(line)
+    pipe.close()
+
+
+def gpu_decodable(codec, pix_fmt):
+    """True when NVDEC can decode the source, so its frames can stay on the GPU."""
+    if codec not in CUVID_DECODERS:
+        return False
+    if pix_fmt in NVDEC_8BIT_PIX_FMTS:
+        return True
+    return codec in NVDEC_10BIT_CODECS and pix_fmt in NVDEC_10BIT_PIX_FMTS
 
+
+def decoder_args(codec, pix_fmt):
+    """Builds the -hwaccel/decoder input options for a source codec and format."""
+    if not gpu_decodable(codec, pix_fmt):
+        return ["-hwaccel", "cuda"]
+    cuvid_decoder = CUVID_DECODERS[codec]
+    # -extra_hw_frames leaves headroom in the decoder's surface pool so
+    # NVENC lookahead/B-frames can't starve it ("No decoder surfaces left",
+    # which can cut throughput several times over on consumer GPUs).
+    return [
+        "-hwaccel",
+        "cuda",
+        "-hwaccel_output_format",
+        "cuda",
+        "-extra_hw_frames",
+        "8",
+        "-c:v",
+        cuvid_decoder,
+    ]
+
+
+def audio_args(audio_codec):
+    """
+    Builds the -c:a options: AUDIO_CODEC, except that audio an MP4 can't hold
+    is re-encoded to AAC instead of being copied into a failing mux.
+    """
+    if AUDIO_CODEC == "copy" and audio_codec and audio_codec not in MP4_AUDIO_CODECS:
+        return ["-c:a", "aac", "-b:a", "192k"]
+    return ["-c:a", AUDIO_CODEC]
+
+
+def b_frame_args(preset_config):
+    """
+    Builds the B-frame options. With more than two concurrent encodes B-frames
+    are turned off, since held-back reference frames are what drain the
+    decoder's surface pool.
+    """
+    if NVENC_CONCURRENCY > 2:
+        return ["-bf", "0"]
+    if preset_config["MODE"] == "VBR":
+        return ["-bf", "3", "-b_ref_mode", "middle"]
+    return []
+
+
+def rate_control_args(preset_config):
+    """Builds the hevc_nvenc encoder and rate-control options for a preset."""
+    if preset_config["MODE"] == "VBR":
+        # NVENC's own multipass analyses each frame inside the single
+        # session, so one decode/encode replaces the old Pass 1 + Pass 2.
+        target_bitrate = f"{TARGET_BITRATE_KBPS}k"
+        max_bitrate = f"{int(TARGET_BITRATE_KBPS * 1.5)}k"
+        return [
+            "-c:v",
+            "hevc_nvenc",
+            "-preset",
+            preset_config["GPU_PRESET"],
+            "-rc",
+            "vbr",
+            "-b:v",
+            target_bitrate,
+            "-maxrate",
+            max_bitrate,
+            "-multipass",
+            "fullres",
+            "-g",
+            "250",
+            *b_frame_args(preset_config),
+            *encoder_tuning_args(preset_config),
+        ]
+
+    # MODE is "CQ"
+    return [
+        "-c:v",
+        "hevc_nvenc",
+        "-preset",
+        preset_config["GPU_PRESET"],
+        "-rc",
+        "vbr_hq",
+        "-cq",
+        str(preset_config["H265_CQ"]),
+        "-qmin",
+        "0",
+        "-b:v",
+        "0",
+        *b_frame_args(preset_config),
+        *encoder_tuning_args(preset_config),
+    ]
+
+
+def local_cpus(pci_bus_id):
+    """Reads the CPUs attached to a PCI device's NUMA node from sysfs."""
+    domain, _, rest = pci_bus_id.lower().partition(":")
     try:
-        with tempfile.NamedTemporaryFile(
-            delete=False, mode="w+", suffix=".txt", encoding="utf-8"
-        ) as tmp:
-            progress_file_path = tmp.name
-
-        base_args = [FFMPEG_PATH, "-nostdin", "-fflags", "+genpts"]
-
-        if input_file.lower().endswith(".mkv"):
-            base_args.extend(["-f", "matroska"])
-
-        base_args.extend(["-hwaccel", "cuda", "-i", input_file])
-
-        if preset_config["MODE"] == "VBR":
-            target_bitrate = f"{TARGET_BITRATE_KBPS}k"
-            max_bitrate = f"{int(TARGET_BITRATE_KBPS * 1.5)}k"
-            common_args = base_args + [
-                "-c:v",
-                "hevc_nvenc",
-                "-preset",
-                preset_config["GPU_PRESET"],
-                "-rc",
-                "vbr",
-                "-b:v",
-                target_bitrate,
-                "-maxrate",
-                max_bitrate,
-                "-multipass",
-                "2",
-                "-g",
-                "250",
-                "-bf",
-                "3",
-                "-b_ref_mode",
-                "middle",
-                "-temporal-aq",
-                "1",
-                "-spatial-aq",
-                "1",
-                "-y",
-                "-progress",
-                progress_file_path,
-            ]
+        with open(
+            f"/sys/bus/pci/devices/{domain[-4:]}:{rest}/local_cpulist",
+            encoding="ascii",
+        ) as f:
+            cpulist = f.read().strip()
+    except OSError:
+        return None
 
-            with open(log_file_path, "w", encoding="utf-8") as log_file:
-                # Pass 1
-                pass1_args = common_args + [
-                    "-pass",
-                    "1",
-                    "-an",
-                    "-f",
-                    "null",
-                    os.devnull,
-                ]
-                process1 = subprocess.Popen(
-                    pass1_args, stdout=log_file, stderr=subprocess.STDOUT
-                )
-                monitor_ffmpeg_progress(
-                    process1, total_frames, progress_file_path, "Pass 1/2 Analyzing"
-                )
-                if process1.wait() != 0:
-                    print(f"\n[ERROR] FFmpeg Pass 1 failed. See log: {log_file_path}")
-                    return False
-
-                # Pass 2
-                pass2_args = common_args + [
-                    "-pass",
-                    "2",
-                    "-c:a",
-                    AUDIO_CODEC,
-                    output_file,
-                ]
-                process2 = subprocess.Popen(
-                    pass2_args, stdout=log_file, stderr=subprocess.STDOUT
-                )
-                monitor_ffmpeg_progress(
-                    process2, total_frames, progress_file_path, "Pass 2/2 Encoding "
-                )
-                if process2.wait() != 0:
-                    print(f"\n[ERROR] FFmpeg Pass 2 failed. See log: {log_file_path}")
-                    return False
-
-            if os.path.exists(log_file_path):
-                os.remove(log_file_path)
-            return True
-
-        else:  # MODE is "CQ"
-            command_to_run = base_args + [
-                "-c:v",
-                "hevc_nvenc",
-                "-preset",
-                preset_config["GPU_PRESET"],
-                "-rc",
-                "vbr_hq",
-                "-cq",
-                str(preset_config["H265_CQ"]),
-                "-qmin",
-                "0",
-                "-b:v",
-                "0",
-                "-c:a",
-                AUDIO_CODEC,
-                "-sn",
-                "-y",
-                "-progress",
-                progress_file_path,
-            ]
-            if preset_config.get("SCALE"):
-                command_to_run.extend(["-vf", f"scale_cuda={preset_config['SCALE']}"])
-            command_to_run.append(output_file)
+    cpus = set()
+    for part in cpulist.split(","):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus or None
 
-            with open(log_file_path, "w", encoding="utf-8") as log_file:
-                process = subprocess.Popen(
-                    command_to_run, stdout=log_file, stderr=subprocess.STDOUT
-                )
 
-            monitor_ffmpeg_progress(
-                process, total_frames, progress_file_path, "Single Pass Encoding"
+def detect_gpus():
+    """
+    Returns the local CPU set (or None) of every NVIDIA GPU, ordered by PCI bus
+    ID. Falls back to a single GPU with unknown locality.
+    """
+    bus_ids = []
+    if pynvml is not None:
+        try:
+            pynvml.nvmlInit()
+            try:
+                for index in range(pynvml.nvmlDeviceGetCount()):
+                    handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+                    bus_id = pynvml.nvmlDeviceGetPciInfo(handle).busId
+                    if isinstance(bus_id, bytes):
+                        bus_id = bus_id.decode()
+                    bus_ids.append(bus_id)
+            finally:
+                pynvml.nvmlShutdown()
+        except pynvml.NVMLError:
+            bus_ids = []
+
+    if not bus_ids:
+        try:
+            result = subprocess.run(
+                ["nvidia-smi", "--query-gpu=pci.bus_id", "--format=csv,noheader"],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                check=True,
             )
+            bus_ids = result.stdout.split()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+
+    # NVML and nvidia-smi list GPUs by PCI bus ID; run_ffmpeg sets
+    # CUDA_DEVICE_ORDER to match when picking a device.
+    return [local_cpus(bus_id) for bus_id in sorted(bus_ids)] or [None]
 
-            if process.wait() != 0:
-                print(f"\n[ERROR] FFmpeg process failed. See log: {log_file_path}")
-                return False
 
-            if os.path.exists(log_file_path):
-                os.remove(log_file_path)
-            return True
+def make_gpu_slots(gpu_count):
+    """
+    Returns a queue holding each GPU id once per NVENC session it may run, so
+    taking an id both picks a GPU and counts against that GPU's own limit.
+    """
+    slots = Queue()
+    for _ in range(NVENC_CONCURRENCY):
+        for gpu_id in range(gpu_count):
+            slots.put(gpu_id)
+    return slots
+
+
+# Free NVENC sessions by GPU id; copy-only jobs never take one.
+gpu_slots = make_gpu_slots(1)
+
+
+@contextmanager
+def nvenc_session():
+    """Waits for a free NVENC session and yields the id of the GPU it is on."""
+    gpu_id = gpu_slots.get()
+    try:
+        yield gpu_id
+    finally:
+        gpu_slots.put(gpu_id)
 
+
+def run_ffmpeg(command, total_frames, description, log_file_path, gpu_id=0):
+    """
+    Runs an ffmpeg command that reports `-progress pipe:1`, showing a progress
+    bar. Returns True on success; on failure the stderr tail goes to the log.
+    """
+    env = None
+    if len(gpu_cpusets) > 1:
+        env = {
+            **os.environ,
+            "CUDA_DEVICE_ORDER": "PCI_BUS_ID",
+            "CUDA_VISIBLE_DEVICES": str(gpu_id),
+        }
+
+    try:
+        # -progress pipe:1 sends progress over an anonymous in-memory pipe on every
+        # platform, so no progress file or FIFO ever touches the disk. It is read
+        # with blocking reads; a larger buffer means fewer read syscalls.
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1 << 20,
+            env=env,
+        )
     except FileNotFoundError:
-        print(f"\n[FATAL ERROR] Cannot find ffmpeg. Please check the FFMPEG_PATH.")
+        log(f"\n[FATAL ERROR] Cannot find ffmpeg. Please check the FFMPEG_PATH.")
         sys.exit(1)
-    finally:
-        if os.path.exists(progress_file_path):
-            os.remove(progress_file_path)
 
+    # Keep ffmpeg's decode/upload threads on the GPU's NUMA node so frames don't
+    # cross the socket interconnect. Set after spawning since preexec_fn isn't
+    # safe with worker threads.
+    cpus = gpu_cpusets[gpu_id]
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(process.pid, (cpus & os.sched_getaffinity(0)) or cpus)
+        except OSError:
+            pass
+
+    # stderr stays in memory and only reaches the disk if the encode fails.
+    err_lines = deque(maxlen=500)
+    stderr_reader = threading.Thread(
+        target=drain_stream, args=(process.stderr, err_lines), daemon=True
+    )
+    stderr_reader.start()
+    monitor_ffmpeg_progress(process, total_frames, description)
+
+    returncode = process.wait()
+    stderr_reader.join()
+    if returncode != 0:
+        with open(log_file_path, "wb") as log_file:
+            log_file.writelines(err_lines)
+        log(f"\n[ERROR] FFmpeg process failed. See log: {log_file_path}")
+        return False
+    return True
 
-def process_files_recursively(root_input, root_output, preset_config):
-    """Recursively scans and processes video files."""
-    all_files = [
-        os.path.join(dp, f)
-        for dp, _, fn in os.walk(root_input)
-        for f in fn
-        if not f.startswith(".")
+
+def compress_video_gpu(input_file, output_file, file_details, preset_config, gpu_id=0):
+    """Compresses a video, streaming progress over a pipe and keeping logs in memory."""
+    log_file_path = os.path.splitext(output_file)[0] + "_ffmpeg_log.txt"
+    label = os.path.basename(input_file)
+
+    command_to_run = [
+        FFMPEG_PATH,
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-fflags",
+        "+genpts",
     ]
+    if input_file.lower().endswith(".mkv"):
+        command_to_run.extend(["-f", "matroska"])
+    command_to_run.extend(decoder_args(file_details["codec"], file_details["pix_fmt"]))
+    command_to_run.extend(["-i", input_file])
+    command_to_run.extend(
+        video_filter_args(
+            preset_config,
+            gpu_decodable(file_details["codec"], file_details["pix_fmt"]),
+            file_details["pix_fmt"],
+        )
+    )
+    command_to_run.extend(rate_control_args(preset_config))
+    command_to_run.extend(audio_args(file_details.get("audio_codec")))
 
-    for i, input_path in enumerate(all_files):
-        relative_path = os.path.relpath(input_path, root_input)
-        print(f"\n--- Processing file {i + 1} of {len(all_files)}: {relative_path} ---")
+    if preset_config["MODE"] == "VBR":
+        description = f"[{label}] VBR Encoding"
+    else:
+        command_to_run.append("-sn")
+        description = f"[{label}] Single Pass Encoding"
+    command_to_run.extend(
+        ["-y", "-progress", "pipe:1", "-stats_period", "1", "-nostats", output_file]
+    )
 
-        is_video = input_path.lower().endswith(VIDEO_EXTENSIONS)
-        output_path = (
-            os.path.join(root_output, os.path.splitext(relative_path)[0] + ".mp4")
-            if is_video
-            else os.path.join(root_output, relative_path)
+    return run_ffmpeg(
+        command_to_run,
+        file_details["total_frames"],
+        description,
+        log_file_path,
+        gpu_id,
+    )
+
+
+def rewind_copy(fsrc, fdst):
+    """Resets both files so a failed copy method can restart from scratch."""
+    fsrc.seek(0)
+    fdst.seek(0)
+    fdst.truncate()
+
+
+def vpf_encoder_options(file_details, preset_config):
+    """Maps a preset onto PyNvEncoder's ffmpeg-style option dict."""
+    options = {
+        "codec": "hevc",
+        "preset": preset_config["GPU_PRESET"].upper(),
+        "s": f"{file_details['width']}x{file_details['height']}",
+        "gop": "250",
+    }
+    if preset_config["MODE"] == "VBR":
+        options.update(
+            {
+                "rc": "vbr",
+                "bitrate": f"{TARGET_BITRATE_KBPS}K",
+                "maxbitrate": f"{int(TARGET_BITRATE_KBPS * 1.5)}K",
+                "multipass": "fullres",
+            }
+        )
+    else:
+        options.update(
+            {"rc": "vbr", "bitrate": "0", "cq": str(preset_config["H265_CQ"])}
         )
+    if preset_config.get("TUNE") == "hq":
+        options["tuning_info"] = "high_quality"
+    if preset_config.get("AQ"):
+        options.update({"aq": "1", "temporalaq": "1"})
+    if preset_config.get("LOOKAHEAD"):
+        options["lookahead"] = str(preset_config["LOOKAHEAD"])
+    return options
 
-        if os.path.exists(output_path):
-            print("Output file already exists. Skipping.")
-            continue
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-        if not is_video:
-            print("Not a video file. Copying directly...")
-            shutil.copy2(input_path, output_path)
-            continue
+def compress_video_vpf(input_file, output_file, file_details, preset_config, gpu_id=0):
+    """
+    Encodes the video stream in-process with VPF, then muxes it with the
+    source audio via ffmpeg. Falls back to compress_video_gpu for sources VPF
+    can't take directly or when VPF rejects the file or options.
+    """
+    if (
+        preset_config.get("SCALE")
+        or file_details["codec"] not in CUVID_DECODERS
+        or file_details["pix_fmt"] not in ("yuv420p", "yuvj420p", "nv12")
+        or not (file_details.get("width") and file_details.get("frame_rate"))
+        # The raw stream is muxed at one fixed rate, which would retime VFR.
+        or not constant_frame_rate(file_details)
+    ):
+        return compress_video_gpu(
+            input_file, output_file, file_details, preset_config, gpu_id
+        )
 
-        codec, bit_rate, total_frames = get_video_details(input_path)
-        if total_frames == 0:
-            print(
-                "Warning: Could not determine total frames. Progress bar may not be accurate."
+    label = os.path.basename(input_file)
+    description = f"[{label}] VPF Encoding"
+    total_frames = file_details["total_frames"]
+    stream_path = os.path.splitext(output_file)[0] + ".hevc"
+    try:
+        decoder = nvc.PyNvDecoder(input_file, gpu_id)
+        encoder = nvc.PyNvEncoder(
+            vpf_encoder_options(file_details, preset_config), gpu_id
+        )
+        packet = np.ndarray(shape=(0,), dtype=np.uint8)
+        frames_done = 0
+        with open(stream_path, "wb") as stream:
+            # Surfaces stay in GPU memory from NVDEC to NVENC; only the
+            # compressed packets come back to the host.
+            while True:
+                surface = decoder.DecodeSingleSurface()
+                if surface.Empty():
+                    break
+                if encoder.EncodeSingleSurface(surface, packet):
+                    stream.write(packet.tobytes())
+                frames_done += 1
+                if total_frames > 0 and frames_done % 100 == 0:
+                    print_progress(
+                        description, min(frames_done, total_frames), total_frames
+                    )
+            while encoder.FlushSinglePacket(packet):
+                stream.write(packet.tobytes())
+    except Exception as e:
+        # VPF reports unsupported streams/options with plain RuntimeErrors.
+        log(f"\n[{label}] VPF could not encode this file ({e}). Using ffmpeg.")
+        if os.path.exists(stream_path):
+            os.remove(stream_path)
+        return compress_video_gpu(
+            input_file, output_file, file_details, preset_config, gpu_id
+        )
+    print_progress_complete(description)
+
+    # The elementary stream carries no container timing or display matrix, so
+    # its frame rate and rotation are given explicitly when muxing it with the
+    # source's audio and metadata.
+    command = [
+        FFMPEG_PATH,
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-framerate",
+        file_details["frame_rate"],
+        *(
+            ["-display_rotation", str(file_details["rotation"])]
+            if file_details.get("rotation")
+            else []
+        ),
+        "-i",
+        stream_path,
+        "-i",
+        input_file,
+        "-map",
+        "0:v",
+        "-map",
+        "1:a?",
+        "-map_metadata",
+        "1",
+        "-c:v",
+        "copy",
+        *audio_args(file_details.get("audio_codec")),
+        "-tag:v",
+        "hvc1",
+        "-movflags",
+        "+faststart",
+        "-y",
+        output_file,
+    ]
+    try:
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True)
+    except FileNotFoundError:
+        log(f"\n[FATAL ERROR] Cannot find ffmpeg. Please check the FFMPEG_PATH.")
+        sys.exit(1)
+    finally:
+        os.remove(stream_path)
+    if result.returncode != 0:
+        log_file_path = os.path.splitext(output_file)[0] + "_ffmpeg_log.txt"
+        with open(log_file_path, "wb") as log_file:
+            log_file.write(result.stderr)
+        log(f"\n[ERROR] Muxing the VPF stream failed. See log: {log_file_path}")
+        return False
+    return True
+
+
+def copy_file_contents(fsrc, fdst):
+    """Copies an open file's contents, in-kernel on Linux when supported."""
+    if hasattr(os, "copy_file_range"):
+        # copy_file_range keeps the data in the kernel and becomes a reflink on
+        # CoW filesystems like Btrfs/XFS, so large videos copy almost instantly.
+        try:
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30) > 0:
+                pass
+            return
+        except OSError:
+            # Unsupported here (e.g. cross-filesystem on older kernels).
+            rewind_copy(fsrc, fdst)
+    if sys.platform.startswith("linux"):
+        # sendfile also stays in the kernel and works file-to-file on every
+        # Linux kernel Python supports, covering older kernels and filesystems
+        # where copy_file_range is refused.
+        try:
+            offset = 0
+            while True:
+                sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, 1 << 30)
+                if sent == 0:
+                    return
+                offset += sent
+        except OSError:
+            rewind_copy(fsrc, fdst)
+    shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+
+
+def fast_copy(src, dst):
+    """Copies a file using the fastest available method, then its metadata."""
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            copy_file_contents(fsrc, fdst)
+    except OSError:
+        shutil.copy2(src, dst)
+        return
+    shutil.copystat(src, dst)
+
+
+def remux_or_copy(input_path, output_path, codec, audio_codec=None):
+    """Moves an already-efficient video into the output tree without re-encoding."""
+    if input_path.lower().endswith(".mp4"):
+        # Same container: copy as is. fast_copy reflinks on CoW filesystems, and
+        # unlike a hard link the output never shares the input's inode.
+        fast_copy(input_path, output_path)
+        return
+
+    if codec == "hevc":
+        # Only the container changes, so rewrite headers instead of copying bytes.
+        command = [
+            FFMPEG_PATH,
+            "-nostdin",
+            "-v",
+            "error",
+            "-i",
+            input_path,
+            "-c",
+            "copy",
+            *audio_args(audio_codec),
+            "-tag:v",
+            "hvc1",
+            "-sn",
+            "-movflags",
+            "+faststart",
+            "-y",
+            output_path,
+        ]
+        try:
+            result = subprocess.run(
+                command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
             )
+            if result.returncode == 0:
+                return
+        except FileNotFoundError:
+            pass
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    fast_copy(input_path, output_path)
 
-        bitrate_threshold_kbps = (
-            TARGET_BITRATE_KBPS if preset_config["MODE"] == "VBR" else 2500
+
+def finalize_compressed(
+    input_path,
+    input_size,
+    output_path,
+    relative_path,
+    success,
+    file_details,
+    preset_config,
+):
+    """
+    Keeps the encoded file or falls back to the original based on its size.
+    Returns "compressed", "kept_original" or "error".
+    """
+    if not success:
+        log(f"\n[{relative_path}] Copying original due to compression error.")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        fast_copy(input_path, output_path)
+        return "error"
+
+    try:
+        output_size = os.stat(output_path).st_size
+    except FileNotFoundError:
+        output_size = 0
+    if output_size == 0:
+        log(
+            f"\n[{relative_path}] Output file not created or is empty. Copying original."
         )
-        if codec == "hevc" and (0 < bit_rate < (bitrate_threshold_kbps * 1000)):
-            print(f"Already efficient. Copying...")
-            shutil.copy2(input_path, output_path)
-            continue
+        fast_copy(input_path, output_path)
+        return "error"
+
+    record_size_sample(preset_config, file_details, output_size)
+    if output_size >= input_size:
+        log(f"\n[{relative_path}] Output larger. Copying original.")
+        fast_copy(input_path, output_path)
+        return "kept_original"
+
+    reduction = ((input_size - output_size) / input_size) * 100
+    if reduction < MINIMUM_COMPRESSION_PERCENT:
+        log(
+            f"\n[{relative_path}] Reduction ({reduction:.1f}%) below minimum. Copying original."
+        )
+        fast_copy(input_path, output_path)
+        return "kept_original"
+
+    log(
+        f"\n[{relative_path}] Compression successful. Size reduced by {reduction:.1f}%."
+    )
+    return "compressed"
+
+
+def iter_files(root):
+    """
+    Yields (path, stat) for every non-hidden file under root, walking with an
+    explicit stack of os.scandir calls instead of nested generators.
+    """
+    pending_dirs = [root]
+    while pending_dirs:
+        with os.scandir(pending_dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+                elif not entry.name.startswith(".") and entry.is_file():
+                    yield entry.path, entry.stat()
+
+
+def make_output_dir(output_path, created_dirs):
+    """Creates the parent directory of output_path once per run."""
+    output_dir = os.path.dirname(output_path)
+    if output_dir not in created_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+        created_dirs.add(output_dir)
+
+
+def already_efficient(file_details, preset_config):
+    """True for HEVC sources whose bitrate is already below the re-encode threshold."""
+    bitrate_threshold_kbps = (
+        TARGET_BITRATE_KBPS if preset_config["MODE"] == "VBR" else 2500
+    )
+    return file_details["codec"] == "hevc" and (
+        0 < file_details["bit_rate"] < (bitrate_threshold_kbps * 1000)
+    )
+
 
-        print(
-            f"Compressing (codec: {codec or 'unknown'}, bitrate: {bit_rate/1000:.0f}kbps)..."
+def estimated_reduction(file_details, input_size, preset_config):
+    """Returns the predicted size reduction in percent, or None without an estimate."""
+    estimated_size = estimate_output_size(file_details, input_size, preset_config)
+    if estimated_size is None or input_size <= 0:
+        return None
+    return ((input_size - estimated_size) / input_size) * 100
+
+
+def process_file(
+    position,
+    input_path,
+    input_size,
+    root_input,
+    root_output,
+    preset_config,
+    details,
+    changed_paths,
+    created_dirs,
+):
+    """
+    Decides what to do with one file, encoding it if needed. Existing outputs
+    are only replaced for inputs in changed_paths.
+    Returns a (relative_path, status) tuple for the end-of-run summary.
+    """
+    relative_path = os.path.relpath(input_path, root_input)
+    if stop_requested.is_set():
+        return relative_path, "skipped"
+    log(f"\n--- Processing file {position}: {relative_path} ---")
+
+    is_video = input_path in details
+    output_path = (
+        os.path.join(root_output, os.path.splitext(relative_path)[0] + ".mp4")
+        if is_video
+        else os.path.join(root_output, relative_path)
+    )
+
+    if input_path in changed_paths:
+        log(f"[{relative_path}] Input changed since the last run. Redoing output.")
+        # Unlink rather than overwrite: the old output may share the input's
+        # inode, and writing through it would truncate the source.
+        try:
+            os.remove(output_path)
+        except FileNotFoundError:
+            pass
+    elif os.path.exists(output_path):
+        log(f"[{relative_path}] Output file already exists. Skipping.")
+        return relative_path, "skipped"
+    make_output_dir(output_path, created_dirs)
+
+    if not is_video:
+        log(f"[{relative_path}] Not a video file. Copying directly...")
+        fast_copy(input_path, output_path)
+        return relative_path, "copied_other"
+
+    file_details = details[input_path]
+    codec, bit_rate = file_details["codec"], file_details["bit_rate"]
+    if already_efficient(file_details, preset_config):
+        log(f"[{relative_path}] Already efficient. Remuxing/copying...")
+        remux_or_copy(input_path, output_path, codec, file_details.get("audio_codec"))
+        return relative_path, "copied_video"
+
+    # Skip encodes that are predicted to miss the minimum reduction anyway; the
+    # post-encode size check in finalize_compressed remains the safety net.
+    reduction = estimated_reduction(file_details, input_size, preset_config)
+    if reduction is not None and reduction < MINIMUM_COMPRESSION_PERCENT:
+        if resample_due(file_details, preset_config):
+            log(
+                f"[{relative_path}] Estimated reduction ({reduction:.1f}%) below minimum. Encoding anyway to refresh the estimate."
+            )
+            reduction = None
+    if reduction is not None and reduction < MINIMUM_COMPRESSION_PERCENT:
+        log(
+            f"[{relative_path}] Estimated reduction ({reduction:.1f}%) below minimum. Copying original."
         )
-        success = compress_video_gpu(
-            input_path, output_path, total_frames, preset_config
+        fast_copy(input_path, output_path)
+        return relative_path, "kept_original"
+
+    if file_details["total_frames"] == 0:
+        log(
+            f"[{relative_path}] Warning: Could not determine total frames. Progress bar may not be accurate."
         )
 
-        if not success:
-            print("Copying original due to compression error.")
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            shutil.copy2(input_path, output_path)
-            continue
+    # Copy-only jobs never wait here; only encodes compete for NVENC sessions.
+    with nvenc_session() as gpu_id:
+        if stop_requested.is_set():
+            return relative_path, "skipped"
+        log(
+            f"[{relative_path}] Compressing (codec: {codec or 'unknown'}, bitrate: {bit_rate/1000:.0f}kbps)..."
+        )
+        encode = compress_video_vpf if ENGINE == "vpf" else compress_video_gpu
+        success = encode(input_path, output_path, file_details, preset_config, gpu_id)
+    status = finalize_compressed(
+        input_path,
+        input_size,
+        output_path,
+        relative_path,
+        success,
+        file_details,
+        preset_config,
+    )
+    return relative_path, status
+
+
+def batch_key(file_details):
+    """Stream parameters that must match for clips to share one concat batch."""
+    return (
+        file_details["codec"],
+        file_details.get("width"),
+        file_details.get("height"),
+        file_details["pix_fmt"],
+        file_details.get("frame_rate"),
+        # Mixed audio codecs can't be stream-copied through one concat.
+        file_details.get("audio_codec") or "none",
+    )
 
-        input_size = os.path.getsize(input_path)
-        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-            print("Output file not created or is empty. Copying original.")
-            shutil.copy2(input_path, output_path)
+
+def plan_clip_batches(all_files, details, root_input, root_output, preset_config):
+    """
+    Groups short clips that would be encoded anyway by matching stream
+    parameters. Returns (batches, remaining_files).
+    """
+    groups = {}
+    remaining = []
+    for input_path, input_stat in all_files:
+        file_details = details.get(input_path)
+        relative_path = os.path.relpath(input_path, root_input)
+        output_path = os.path.join(
+            root_output, os.path.splitext(relative_path)[0] + ".mp4"
+        )
+        if (
+            file_details is None
+            or not 0 < file_details["duration"] <= BATCH_CLIP_MAX_SECONDS
+            or not all(batch_key(file_details))
+            or already_efficient(file_details, preset_config)
+            or os.path.exists(output_path)
+        ):
+            remaining.append((input_path, input_stat))
             continue
+        reduction = estimated_reduction(file_details, input_stat.st_size, preset_config)
+        if reduction is not None and reduction < MINIMUM_COMPRESSION_PERCENT:
+            remaining.append((input_path, input_stat))
+            continue
+        groups.setdefault(batch_key(file_details), []).append((input_path, input_stat))
 
-        output_size = os.path.getsize(output_path)
-        if output_size >= input_size:
-            print(f"Output larger. Copying original.")
-            shutil.copy2(input_path, output_path)
-        else:
-            reduction = ((input_size - output_size) / input_size) * 100
-            if reduction < MINIMUM_COMPRESSION_PERCENT:
-                print(f"Reduction ({reduction:.1f}%) below minimum. Copying original.")
-                shutil.copy2(input_path, output_path)
+    batches = []
+    for clips in groups.values():
+        for start in range(0, len(clips), BATCH_MAX_CLIPS):
+            batch = clips[start : start + BATCH_MAX_CLIPS]
+            if len(batch) > 1:
+                batches.append(batch)
             else:
-                print(f"Compression successful. Size reduced by {reduction:.1f}%.")
-        print("Finished processing file.")
+                remaining.extend(batch)
+    return batches, remaining
+
+
+def encode_clip_batch(batch, details, preset_config, work_dir, gpu_id=0):
+    """
+    Encodes a batch of clips with one ffmpeg process (concat demuxer in, segment
+    muxer out). Returns one encoded file per clip, or None if the encode failed
+    or the split doesn't line up with the sources.
+    """
+    concat_path = os.path.join(work_dir, "concat.txt")
+    with open(concat_path, "w", encoding="utf-8") as f:
+        for input_path, _ in batch:
+            escaped_path = os.path.abspath(input_path).replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+
+    durations = [details[input_path]["duration"] for input_path, _ in batch]
+    # Each clip starts where the previous ones end; keyframes are forced there so
+    # the segment muxer can cut exactly on the clip boundaries.
+    boundaries = ",".join(f"{t:.6f}" for t in itertools.accumulate(durations[:-1]))
+    first_details = details[batch[0][0]]
+    command = [
+        FFMPEG_PATH,
+        "-nostdin",
+        "-loglevel",
+        "error",
+        *decoder_args(first_details["codec"], first_details["pix_fmt"]),
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        concat_path,
+        *video_filter_args(
+            preset_config,
+            gpu_decodable(first_details["codec"], first_details["pix_fmt"]),
+            first_details["pix_fmt"],
+        ),
+        *rate_control_args(preset_config),
+        "-force_key_frames",
+        boundaries,
+        *audio_args(first_details.get("audio_codec")),
+        "-sn",
+        "-f",
+        "segment",
+        "-segment_times",
+        boundaries,
+        "-segment_format",
+        "mp4",
+        "-reset_timestamps",
+        "1",
+        "-y",
+        "-progress",
+        "pipe:1",
+        "-stats_period",
+        "1",
+        "-nostats",
+        os.path.join(work_dir, "clip_%04d.mp4"),
+    ]
+    total_frames = sum(details[input_path]["total_frames"] for input_path, _ in batch)
+    description = f"[batch of {len(batch)}] Batch Encoding"
+    if not run_ffmpeg(
+        command, total_frames, description, work_dir + "_ffmpeg_log.txt", gpu_id
+    ):
+        return None
+
+    segments = [
+        os.path.join(work_dir, f"clip_{i:04d}.mp4") for i in range(len(batch) + 1)
+    ]
+    if os.path.exists(segments.pop()):
+        return None
+    for segment, duration in zip(segments, durations):
+        if not os.path.exists(segment):
+            return None
+        segment_duration = get_video_details(segment)["duration"]
+        if abs(segment_duration - duration) > BATCH_DURATION_TOLERANCE:
+            return None
+    return segments
+
+
+def process_clip_batch(
+    position,
+    batch,
+    root_input,
+    root_output,
+    preset_config,
+    details,
+    changed_paths,
+    created_dirs,
+):
+    """
+    Encodes a batch of short clips in one ffmpeg run, falling back to processing
+    them one by one if the batch fails. Returns a list of (relative_path, status).
+    """
+    if stop_requested.is_set():
+        return [(os.path.relpath(path, root_input), "skipped") for path, _ in batch]
+    log(f"\n--- Processing batch {position}: {len(batch)} short clips ---")
+
+    work_dir = tempfile.mkdtemp(prefix=".batch_", dir=root_output)
+    try:
+        with nvenc_session() as gpu_id:
+            if stop_requested.is_set():
+                return [
+                    (os.path.relpath(path, root_input), "skipped") for path, _ in batch
+                ]
+            segments = encode_clip_batch(
+                batch, details, preset_config, work_dir, gpu_id
+            )
+
+        if segments is None:
+            log(
+                f"[batch {position}] Batch did not split cleanly. Encoding its clips one by one."
+            )
+            results = [
+                process_file(
+                    f"{i + 1} of {len(batch)} in batch {position}",
+                    input_path,
+                    input_stat.st_size,
+                    root_input,
+                    root_output,
+                    preset_config,
+                    details,
+                    changed_paths,
+                    created_dirs,
+                )
+                for i, (input_path, input_stat) in enumerate(batch)
+            ]
+            # The batch's failure log only matters if a clip fails on its own too.
+            if all(status != "error" for _, status in results):
+                try:
+                    os.remove(work_dir + "_ffmpeg_log.txt")
+                except FileNotFoundError:
+                    pass
+            return results
+
+        results = []
+        for (input_path, input_stat), segment in zip(batch, segments):
+            relative_path = os.path.relpath(input_path, root_input)
+            output_path = os.path.join(
+                root_output, os.path.splitext(relative_path)[0] + ".mp4"
+            )
+            make_output_dir(output_path, created_dirs)
+            os.replace(segment, output_path)
+            status = finalize_compressed(
+                input_path,
+                input_stat.st_size,
+                output_path,
+                relative_path,
+                True,
+                details[input_path],
+                preset_config,
+            )
+            results.append((relative_path, status))
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def iter_mp4_boxes(f, start, end):
+    """Yields (box_type, payload_start, box_end) for each box in [start, end)."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(16)
+        box_size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if box_size == 1:
+            box_size, header_size = struct.unpack_from(">Q", header, 8)[0], 16
+        elif box_size == 0:  # Runs to the end of the enclosing box.
+            box_size = end - offset
+        if box_size < header_size:
+            return
+        yield box_type, offset + header_size, offset + box_size
+        offset += box_size
+
+
+def find_mp4_box(f, start, end, *box_path):
+    """Returns (payload_start, box_end) of the first box along box_path, or None."""
+    for wanted in box_path:
+        match = next(
+            (
+                (payload_start, box_end)
+                for box_type, payload_start, box_end in iter_mp4_boxes(f, start, end)
+                if box_type == wanted
+            ),
+            None,
+        )
+        if match is None:
+            return None
+        start, end = match
+    return start, end
+
+
+def sniff_mp4_header(path):
+    """
+    Reads the duration and first video track's codec of an MP4/MOV by seeking
+    through box headers, so the sample tables are never read. Returns
+    (is_hevc, duration_seconds), or None if there is no complete moov box.
+    """
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        moov = find_mp4_box(f, 0, file_size, b"moov")
+        if moov is None or moov[1] > file_size:  # Missing or truncated.
+            return None
+        mvhd = find_mp4_box(f, *moov, b"mvhd")
+        if mvhd is None:
+            return None
+        f.seek(mvhd[0])
+        fields = f.read(32)
+        if fields[:1] == b"\x01":
+            timescale, duration = struct.unpack_from(">IQ", fields, 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", fields, 12)
+
+        codec = None
+        for box_type, trak_start, trak_end in iter_mp4_boxes(f, *moov):
+            if box_type != b"trak":
+                continue
+            hdlr = find_mp4_box(f, trak_start, trak_end, b"mdia", b"hdlr")
+            if hdlr is None:
+                continue
+            f.seek(hdlr[0] + 8)
+            if f.read(4) != b"vide":
+                continue
+            stsd = find_mp4_box(
+                f, trak_start, trak_end, b"mdia", b"minf", b"stbl", b"stsd"
+            )
+            if stsd is not None:
+                # The first sample entry's type follows version/flags and count.
+                f.seek(stsd[0] + 12)
+                codec = f.read(4)
+            break
+    return codec in (b"hvc1", b"hev1"), (duration / timescale if timescale else 0.0)
+
+
+def quick_details(input_path, input_size, preset_config):
+    """
+    Returns minimal details for an MP4/MOV whose header alone shows it is
+    already-efficient HEVC, so it can be copied without a probe. Returns None
+    when the file needs a real probe.
+    """
+    if not input_path.lower().endswith((".mp4", ".m4v", ".mov")):
+        return None
+    try:
+        header = sniff_mp4_header(input_path)
+    except (OSError, struct.error, IndexError):
+        return None
+    if header is None or not header[0] or header[1] <= 0:
+        return None
+
+    # The overall bitrate includes audio, so it's an upper bound for the video's.
+    duration = header[1]
+    file_details = video_details(
+        "hevc", int(input_size * 8 / duration), duration=duration
+    )
+    if not already_efficient(file_details, preset_config):
+        return None
+    return file_details
+
+
+def file_fingerprint(path, size):
+    """Hashes a file's size plus its first and last FINGERPRINT_CHUNK_SIZE bytes."""
+    if xxhash is not None:
+        hasher = xxhash.xxh3_64()
+    else:
+        hasher = hashlib.blake2b(digest_size=8)
+    hasher.update(size.to_bytes(8, "little"))
+    with open(path, "rb") as f:
+        hasher.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        if size > FINGERPRINT_CHUNK_SIZE:
+            f.seek(max(FINGERPRINT_CHUNK_SIZE, size - FINGERPRINT_CHUNK_SIZE))
+            hasher.update(f.read(FINGERPRINT_CHUNK_SIZE))
+    return hasher.hexdigest()
+
+
+def probe_videos(video_files, root_input, manifest, preset_config):
+    """
+    Returns ({path: details}, changed_paths) for the given (path, stat) pairs.
+    Manifest entries are reused when size and mtime match, or when only the
+    mtime moved but the fingerprint is the same, and MP4s whose header shows
+    efficient HEVC skip the probe. changed_paths holds inputs whose content
+    changed since the manifest entry was written.
+    """
+    details = {}
+    changed_paths = set()
+    to_probe = []
+    for path, stat in video_files:
+        entry = manifest.get(os.path.relpath(path, root_input))
+        if entry and entry["size"] == stat.st_size:
+            if entry["mtime_ns"] == stat.st_mtime_ns:
+                details[path] = entry["details"]
+                continue
+            if entry.get("hash") == file_fingerprint(path, stat.st_size):
+                entry["mtime_ns"] = stat.st_mtime_ns
+                details[path] = entry["details"]
+                continue
+        if entry:
+            # The stale entry goes now; fast-path files and failed re-probes
+            # don't write a new one, and it would flag the file every run.
+            changed_paths.add(path)
+            del manifest[os.path.relpath(path, root_input)]
+        file_details = quick_details(path, stat.st_size, preset_config)
+        if file_details is not None:
+            details[path] = file_details
+        else:
+            to_probe.append((path, stat))
+
+    if not to_probe:
+        return details, changed_paths
+
+    # ffprobe is process/I-O bound, so probing in a thread pool keeps the
+    # workers from waiting on it file by file.
+    paths = [path for path, _ in to_probe]
+    sizes = [stat.st_size for _, stat in to_probe]
+    with ThreadPoolExecutor(max_workers=min(8, len(to_probe))) as executor:
+        probed = executor.map(get_video_details, paths)
+        fingerprints = executor.map(file_fingerprint, paths, sizes)
+        for (path, stat), file_details, fingerprint in zip(
+            to_probe, probed, fingerprints
+        ):
+            details[path] = file_details
+            if file_details["codec"] is not None:
+                manifest[os.path.relpath(path, root_input)] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "hash": fingerprint,
+                    "details": file_details,
+                }
+    return details, changed_paths
+
+
+def record_outcomes(manifest, results):
+    """Stores each video's final status in its manifest entry."""
+    for relative_path, status in results:
+        if status != "skipped" and relative_path in manifest:
+            manifest[relative_path]["status"] = status
+
+
+def collect_result(future, relative_paths, results):
+    """
+    Adds a finished task's (relative_path, status) results to the list;
+    relative_paths are the files the task covers, recorded as errors if it raised.
+    """
+    try:
+        outcome = future.result()
+    except Exception as e:
+        # One bad file shouldn't abort the run and lose everyone else's result.
+        for relative_path in relative_paths:
+            log(f"\n[ERROR] Could not process {relative_path}: {type(e).__name__}: {e}")
+            results.append((relative_path, "error"))
+        return
+    # Batches return one result per clip.
+    if isinstance(outcome, list):
+        results.extend(outcome)
+    else:
+        results.append(outcome)
+
+
+def process_files_recursively(
+    root_input, root_output, preset_config, jobs=MAX_JOBS, batch_clips=False
+):
+    """
+    Recursively scans and processes video files with a pool of `jobs` workers,
+    encoding matching short clips together when batch_clips is set.
+    Returns the list of per-file statuses.
+    """
+    all_files = list(iter_files(root_input))
+    size_estimates_path = os.path.join(root_output, SIZE_ESTIMATES_FILE)
+    load_size_estimates(size_estimates_path)
+
+    video_files = [
+        (path, stat)
+        for path, stat in all_files
+        if os.path.splitext(path)[1].lower() in VIDEO_EXT_SET
+    ]
+    manifest_path = os.path.join(root_output, MANIFEST_FILE)
+    manifest = load_json_file(manifest_path)
+    details, changed_paths = probe_videos(
+        video_files, root_input, manifest, preset_config
+    )
+    save_json_file(manifest_path, manifest)
+
+    batches = []
+    if batch_clips:
+        batches, all_files = plan_clip_batches(
+            all_files, details, root_input, root_output, preset_config
+        )
+
+    # Workers only launch ffmpeg and copy files, so threads are enough. With more
+    # jobs than NVENC sessions, copies keep running while every session encodes.
+    results = []
+    # Output directories already created this run, to skip repeated makedirs.
+    created_dirs = set()
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        shared_args = (
+            root_input,
+            root_output,
+            preset_config,
+            details,
+            changed_paths,
+            created_dirs,
+        )
+        tasks = itertools.chain(
+            (
+                (
+                    process_clip_batch,
+                    (f"{i + 1} of {len(batches)}", batch),
+                    [os.path.relpath(path, root_input) for path, _ in batch],
+                )
+                for i, batch in enumerate(batches)
+            ),
+            (
+                (
+                    process_file,
+                    (f"{i + 1} of {len(all_files)}", input_path, input_stat.st_size),
+                    [os.path.relpath(input_path, root_input)],
+                )
+                for i, (input_path, input_stat) in enumerate(all_files)
+            ),
+        )
+        # Only a few tasks per worker are queued at once, so large trees don't
+        # hold a future for every file; finished ones are collected as we go.
+        futures = {}
+        for task, task_args, relative_paths in tasks:
+            if len(futures) >= max(1, jobs) * 4:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect_result(future, futures.pop(future), results)
+            futures[executor.submit(task, *task_args, *shared_args)] = relative_paths
+        for future in as_completed(futures):
+            collect_result(future, futures[future], results)
+    except KeyboardInterrupt:
+        stop_requested.set()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        save_size_estimates(size_estimates_path)
+        # Also runs on Ctrl+C, so finished files keep their recorded outcome.
+        record_outcomes(manifest, results)
+        save_json_file(manifest_path, manifest)
+    return results
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GPU H.265 video compressor.")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=MAX_JOBS,
+        help=f"files processed in parallel (default: {MAX_JOBS})",
+    )
+    parser.add_argument(
+        "--batch-clips",
+        action="store_true",
+        help=f"encode short clips (<= {BATCH_CLIP_MAX_SECONDS}s) with matching "
+        "stream parameters together in one ffmpeg run",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("ffmpeg", "vpf"),
+        default=ENGINE,
+        help=f"encoding backend (default: {ENGINE})",
+    )
+    args = parser.parse_args()
+    ENGINE = args.engine
+    if ENGINE == "vpf" and nvc is None:
+        print("[FATAL ERROR] --engine vpf needs PyNvCodec (VPF) and numpy installed.")
+        sys.exit(1)
+    if ENGINE == "vpf":
+        # VPF picks GPUs by CUDA ordinal. Number them in PCI bus order, like
+        # detect_gpus and the CUDA_VISIBLE_DEVICES that run_ffmpeg sets.
+        os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+
     if not os.path.exists(INPUT_FOLDER):
         os.makedirs(INPUT_FOLDER)
     if not os.path.exists(OUTPUT_FOLDER):
@@ -411,14 +1827,41 @@ if __name__ == "__main__":
     print("--- GPU H.265 Video Compressor (v17) ---")
     print(f"Selected Preset: '{SELECTED_PRESET}'")
     if config["MODE"] == "VBR":
-        print(f"Mode: 2-Pass VBR | Target Bitrate: {TARGET_BITRATE_KBPS} kbps")
+        print(f"Mode: Multipass VBR | Target Bitrate: {TARGET_BITRATE_KBPS} kbps")
     else:
         print(f"Mode: Single-Pass CQ | CQ Level: {config['H265_CQ']}")
+    gpu_cpusets = detect_gpus()
+    gpu_slots = make_gpu_slots(len(gpu_cpusets))
+    print(
+        f"Parallel Jobs: {args.jobs} | Concurrent Encodes: {NVENC_CONCURRENCY} "
+        f"x {len(gpu_cpusets)} GPU(s)"
+    )
+    if args.batch_clips:
+        print(f"Clip Batching: clips up to {BATCH_CLIP_MAX_SECONDS}s")
+    print(f"Encoding Engine: {ENGINE}")
+    if av is not None:
+        print("Metadata Reader: PyAV (in-process)")
+    else:
+        print("Metadata Reader: ffprobe (install 'av' to avoid one process per file)")
     print("-" * 42)
 
     try:
-        process_files_recursively(INPUT_FOLDER, OUTPUT_FOLDER, preset_config=config)
+        results = process_files_recursively(
+            INPUT_FOLDER,
+            OUTPUT_FOLDER,
+            preset_config=config,
+            jobs=args.jobs,
+            batch_clips=args.batch_clips,
+        )
+        statuses = [status for _, status in results]
         print("\nProcessing complete.")
+        print("\n--- Summary ---")
+        print(f"Compressed: {statuses.count('compressed')}")
+        print(f"Kept Original (Not Worth It): {statuses.count('kept_original')}")
+        print(f"Copied (Efficient Video): {statuses.count('copied_video')}")
+        print(f"Copied (Non-Video): {statuses.count('copied_other')}")
+        print(f"Skipped (Already Exists): {statuses.count('skipped')}")
+        print(f"Errors: {statuses.count('error')}")
     except KeyboardInterrupt:
         print("\n\n[!] Script stopped by user. Exiting.")
         sys.exit(1)
@@ -2,8 +2,16 @@ import os
 import subprocess
 import shutil
 import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from tqdm import tqdm
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows; fast_copy skips reflinks there.
+
 # --- Main Configuration ---
 # Adjust these paths and settings to fit your needs.
 input_folder = "input"
@@ -33,16 +41,96 @@ BITRATE_THRESHOLD = 1_500_000
 # that pairs well with AV1 but requires re-encoding.
 AUDIO_CODEC = "copy"  # or "libopus"
 
+# --- Parallelism ---
+# Threads given to each SVT-AV1 encode. CPU runs use cpu_count // SVT_THREADS
+# files at once, so the encodes together fill the machine.
+SVT_THREADS = 4
+# Files encoded at once on the GPU. Consumer NVIDIA cards limit concurrent
+# NVENC sessions, so keep this small.
+GPU_WORKERS = 2
+
+# Linux ioctl that clones one file's extents into another (a reflink copy).
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+# CPU encodes of videos longer than SEGMENT_THRESHOLD_SECONDS are cut into
+# SEGMENT_SECONDS pieces at keyframes and the pieces are encoded in parallel,
+# since a single SVT-AV1 instance stops scaling well past a few cores.
+SEGMENT_SECONDS = 30
+SEGMENT_THRESHOLD_SECONDS = 300
+
+# Encoder probe results, keyed by the ffmpeg binary so upgrades are re-probed.
+ENCODER_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "video_compressor",
+    "encoders.json",
+)
+
+
+def ffmpeg_cache_key():
+    """Identifies the ffmpeg on PATH by location, size and mtime, or None if missing."""
+    path = shutil.which("ffmpeg")
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_encoder_cache():
+    """Reads the encoder cache, or returns an empty one."""
+    try:
+        with open(ENCODER_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_encoder_cache(cache):
+    """Writes the encoder cache, ignoring failures."""
+    try:
+        os.makedirs(os.path.dirname(ENCODER_CACHE_FILE), exist_ok=True)
+        with open(ENCODER_CACHE_FILE, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass  # The cache only saves a probe next time.
+
 
 def check_ffmpeg_encoders():
-    """Checks which AV1 encoders are available in FFmpeg."""
+    """
+    Checks which AV1 encoders are available in FFmpeg, reusing the cached
+    answer for this ffmpeg binary when there is one.
+    """
     try:
-        result = subprocess.run(
-            ["ffmpeg", "-encoders"], capture_output=True, text=True, check=True
+        key = ffmpeg_cache_key()
+        if key is None:
+            raise FileNotFoundError("ffmpeg")
+        cache = load_encoder_cache()
+        cached = cache.get(key, {})
+        if "av1_nvenc" in cached and "libsvtav1" in cached:
+            return cached["av1_nvenc"], cached["libsvtav1"]
+
+        # Read the encoder list line by line and stop as soon as both
+        # encoders have been seen instead of collecting the whole listing.
+        found = set()
+        process = subprocess.Popen(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
         )
-        output = result.stdout
-        has_av1_nvenc = "av1_nvenc" in output
-        has_libsvtav1 = "libsvtav1" in output
+        with process:
+            for line in process.stdout:
+                fields = line.split()
+                if len(fields) > 1 and fields[1] in ("av1_nvenc", "libsvtav1"):
+                    found.add(fields[1])
+                    if len(found) == 2:
+                        process.kill()
+                        break
+        has_av1_nvenc = "av1_nvenc" in found
+        has_libsvtav1 = "libsvtav1" in found
+        cached.update({"av1_nvenc": has_av1_nvenc, "libsvtav1": has_libsvtav1})
+        cache[key] = cached
+        save_encoder_cache(cache)
         return has_av1_nvenc, has_libsvtav1
     except FileNotFoundError:
         print(
@@ -55,7 +143,7 @@ def check_ffmpeg_encoders():
 
 
 def get_video_info(file_path):
-    """Uses ffprobe to get the video codec and bitrate."""
+    """Uses ffprobe to get the video codec, bitrate and duration in seconds."""
     command = [
         "ffprobe",
         "-v",
@@ -63,18 +151,105 @@ def get_video_info(file_path):
         "-print_format",
         "json",
         "-show_streams",
+        "-show_format",
         "-select_streams",
         "v:0",
         file_path,
     ]
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        stream = json.loads(result.stdout)["streams"][0]
+        result = subprocess.run(
+            command, stdin=subprocess.DEVNULL, capture_output=True, check=True
+        )
+        info = json.loads(result.stdout)
+        stream = info["streams"][0]
         codec = stream.get("codec_name")
         bit_rate = int(stream.get("bit_rate", 0))
-        return codec, bit_rate
+        # Matroska keeps the duration on the container, not the stream.
+        duration = float(
+            stream.get("duration") or info.get("format", {}).get("duration") or 0
+        )
+        return codec, bit_rate, duration
     except Exception:
-        return None, 0  # Return defaults if ffprobe fails
+        return None, 0, 0.0  # Return defaults if ffprobe fails
+
+
+def svt_av1_args():
+    """Video encoder options for CPU encoding with SVT-AV1."""
+    return [
+        "-c:v",
+        "libsvtav1",
+        "-crf",
+        str(AV1_CRF),
+        "-preset",
+        CPU_PRESET,
+        "-svtav1-params",
+        "tune=0",  # Tune for visual quality over PSNR
+        "-threads",
+        str(SVT_THREADS),
+    ]
+
+
+def fast_copy(src, dst):
+    """
+    Copies a file and its metadata, trying a reflink first, then an in-kernel
+    sendfile loop, and finally a plain buffered copy.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        copied = False
+        if fcntl is not None:
+            # On Btrfs/XFS a reflink shares the data blocks, so any size is O(1).
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                copied = True
+            except OSError:
+                pass
+        if not copied and hasattr(os, "sendfile"):
+            try:
+                offset = 0
+                while True:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, 1 << 20)
+                    if sent == 0:
+                        break
+                    offset += sent
+                copied = True
+            except OSError:
+                fdst.seek(0)
+                fdst.truncate()
+        if not copied:
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+
+
+def fallback_link(src, dst):
+    """
+    Puts the original file in place of a failed encode. A hard link costs no
+    space when both trees share a filesystem; otherwise it is copied.
+    """
+    try:
+        os.remove(dst)  # Drop any partial ffmpeg output first.
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        # EXDEV across filesystems, or no hard link support.
+        fast_copy(src, dst)
+
+
+def run_quiet(command):
+    """
+    Runs an ffmpeg command with only errors logged, returning the decoded
+    stderr on failure and None on success.
+    """
+    result = subprocess.run(
+        command[:1] + ["-loglevel", "error"] + command[1:],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode == 0:
+        return None
+    return result.stderr.decode("utf-8", errors="replace").strip()
 
 
 def compress_video_av1(input_file, output_file, use_gpu=False):
@@ -110,79 +285,331 @@ def compress_video_av1(input_file, output_file, use_gpu=False):
             "ffmpeg",
             "-i",
             input_file,
-            "-c:v",
-            "libsvtav1",
-            "-crf",
-            str(AV1_CRF),
-            "-preset",
-            CPU_PRESET,
-            "-svtav1-params",
-            "tune=0",  # Tune for visual quality over PSNR
+            *svt_av1_args(),
             "-c:a",
             AUDIO_CODEC,
             "-y",
             output_file,
         ]
 
-    # Run the command, capturing output to hide it unless there's an error
-    result = subprocess.run(command, capture_output=True, text=True)
+    # Run the command quietly; stderr is only kept to report a failure
+    error = run_quiet(command)
 
     # If conversion fails, print the error and copy the original file
-    if result.returncode != 0:
-        print(
-            f"\n[ERROR] Failed to compress {os.path.basename(input_file)}:\n{result.stderr.strip()}"
-        )
+    if error is not None:
+        print(f"\n[ERROR] Failed to compress {os.path.basename(input_file)}:\n{error}")
         try:
-            shutil.copy2(input_file, output_file)
+            fallback_link(input_file, output_file)
             print("        Copied original file as a fallback.")
         except Exception as e:
             print(f"        [ERROR] Failed to copy fallback file: {e}")
 
 
+def segment_encode(input_file, output_file, workers, segment_seconds=SEGMENT_SECONDS):
+    """
+    Encodes a long video with SVT-AV1 by cutting it into keyframe-aligned
+    segments, encoding up to `workers` segments at once and joining the
+    results. Audio is taken from the original in the final mux. Falls back to
+    a whole-file encode if any step fails.
+    """
+    with tempfile.TemporaryDirectory(
+        prefix=".segments_", dir=os.path.dirname(output_file) or "."
+    ) as temp_dir:
+        # 1. Split the video stream at the nearest keyframes without re-encoding.
+        error = run_quiet(
+            [
+                "ffmpeg",
+                "-i",
+                input_file,
+                "-map",
+                "0:v:0",
+                "-c",
+                "copy",
+                "-f",
+                "segment",
+                "-segment_time",
+                str(segment_seconds),
+                "-reset_timestamps",
+                "1",
+                "-y",
+                os.path.join(temp_dir, "seg_%04d.mkv"),
+            ]
+        )
+        segments = sorted(
+            os.path.join(temp_dir, name)
+            for name in os.listdir(temp_dir)
+            if name.startswith("seg_")
+        )
+
+        # 2. Encode the segments in parallel. Threads are enough here since
+        # each one just waits on its ffmpeg process.
+        encoded = [
+            os.path.join(temp_dir, "enc_" + os.path.basename(path)[4:])
+            for path in segments
+        ]
+        if error is None and segments:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                errors = executor.map(
+                    run_quiet,
+                    [
+                        ["ffmpeg", "-i", seg, *svt_av1_args(), "-an", "-y", enc]
+                        for seg, enc in zip(segments, encoded)
+                    ],
+                )
+                error = next((e for e in errors if e is not None), None)
+
+        # 3. Join the encoded segments and bring the audio back from the source.
+        if error is None and segments:
+            concat_list = os.path.join(temp_dir, "concat.txt")
+            with open(concat_list, "w", encoding="utf-8") as f:
+                for path in encoded:
+                    escaped = path.replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            error = run_quiet(
+                [
+                    "ffmpeg",
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    concat_list,
+                    "-i",
+                    input_file,
+                    "-map",
+                    "0:v",
+                    "-map",
+                    "1:a?",
+                    "-c:v",
+                    "copy",
+                    "-c:a",
+                    AUDIO_CODEC,
+                    "-y",
+                    output_file,
+                ]
+            )
+
+    if error is None and segments:
+        return
+    tqdm.write(
+        f"[WARN] Segmented encode failed for {os.path.basename(input_file)}, "
+        f"encoding it whole instead:\n{error or 'No segments were produced.'}"
+    )
+    compress_video_av1(input_file, output_file, use_gpu=False)
+
+
+def iter_files(root):
+    """Yields the path of every file under root, walking it with os.scandir."""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+
+def output_path_for(input_path, root_input, root_output):
+    """Maps an input file to its path in the output tree."""
+    return os.path.join(root_output, os.path.relpath(input_path, root_input))
+
+
+def partial_path(output_path):
+    """
+    Temporary name an output is written under, e.g. "a.mp4" -> "a.part.mp4".
+    The real extension stays last so ffmpeg still picks the right muxer.
+    """
+    base, ext = os.path.splitext(output_path)
+    return f"{base}.part{ext}"
+
+
+def process_single_file(
+    input_path, root_input, root_output, use_gpu, video_info, segment_workers=0
+):
+    """
+    Compresses or copies one file. Runs in a worker process; video_info is the
+    prefetched (codec, bit_rate, duration) for videos and None for other files.
+    A non-zero segment_workers lets long CPU encodes use segment_encode.
+    """
+    output_path = output_path_for(input_path, root_input, root_output)
+    # Everything is written to a partial file first and renamed into place at
+    # the end, so an interrupted run never leaves a truncated output behind.
+    part_path = partial_path(output_path)
+
+    # Check if the file is a video
+    if input_path.lower().endswith(VIDEO_EXTENSIONS):
+        codec, bit_rate, duration = video_info
+
+        # --- Intelligent Decision Logic ---
+        # Condition 1: Is the video already AV1?
+        # Condition 2: Is the bitrate too low to be worth re-encoding?
+        if codec == "av1" or (0 < bit_rate < BITRATE_THRESHOLD):
+            tqdm.write(f"Copying (already efficient): {os.path.basename(input_path)}")
+            try:
+                fast_copy(input_path, part_path)
+            except Exception as e:
+                print(f"\n[ERROR] Could not copy {input_path}: {e}")
+        elif (
+            not use_gpu and segment_workers > 1 and duration > SEGMENT_THRESHOLD_SECONDS
+        ):
+            segment_encode(input_path, part_path, segment_workers)
+        else:
+            # If conditions are not met, it's worth compressing
+            compress_video_av1(input_path, part_path, use_gpu=use_gpu)
+    else:
+        # It's not a video file, so just copy it directly
+        try:
+            fast_copy(input_path, part_path)
+        except Exception as e:
+            print(f"\n[ERROR] Could not copy {input_path}: {e}")
+
+    if os.path.exists(part_path):
+        os.replace(part_path, output_path)
+
+
+def make_output_tree(files, root_input, root_output):
+    """Creates every output directory the files need, once per directory."""
+    for relative_dir in {
+        os.path.dirname(os.path.relpath(p, root_input)) for p in files
+    }:
+        os.makedirs(os.path.join(root_output, relative_dir), exist_ok=True)
+
+
+def copy_with_tar(files, root_input, root_output):
+    """
+    Copies files from root_input to the same relative paths under root_output
+    through one tar pipe instead of a copy per file. Returns True on success.
+    The archive is unpacked into a staging directory and each file is renamed
+    into place afterwards, so a failed tar leaves no truncated outputs behind.
+    """
+    tar = shutil.which("tar")
+    if tar is None:
+        return False
+    # "./" keeps names starting with "-" from being read as tar options.
+    names = b"".join(
+        os.fsencode(os.path.join(".", os.path.relpath(path, root_input))) + b"\0"
+        for path in files
+    )
+    staging_dir = tempfile.mkdtemp(prefix=".tar_", dir=root_output)
+    try:
+        pack = subprocess.Popen(
+            [tar, "-C", root_input, "--null", "-T", "-", "-cf", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        unpack = subprocess.Popen(
+            [tar, "-C", staging_dir, "--no-same-owner", "-xf", "-"],
+            stdin=pack.stdout,
+        )
+        pack.stdout.close()  # Only unpack reads the archive.
+        pack.stdin.write(names)
+        pack.stdin.close()
+        if pack.wait() != 0 or unpack.wait() != 0:
+            return False
+        for path in files:
+            relative_path = os.path.relpath(path, root_input)
+            os.replace(
+                os.path.join(staging_dir, relative_path),
+                os.path.join(root_output, relative_path),
+            )
+        return True
+    except OSError:
+        return False
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
 def process_files_recursively(root_input, root_output, use_gpu):
     """
     Recursively scans the input directory, compresses videos to AV1, and
     copies all other files, maintaining the original directory structure.
+    Files are handled by a pool of worker processes.
     """
     # First, find all files to get an accurate total for the progress bar
-    all_files_to_process = [
-        os.path.join(dp, f) for dp, dn, fn in os.walk(root_input) for f in fn
+    all_files_to_process = list(iter_files(root_input))
+    make_output_tree(all_files_to_process, root_input, root_output)
+
+    # Outputs only appear through the final rename, so any non-empty one is
+    # complete and its input can be skipped before it is even probed.
+    pending_files = []
+    for path in all_files_to_process:
+        output_path = output_path_for(path, root_input, root_output)
+        if not (os.path.exists(output_path) and os.path.getsize(output_path) > 0):
+            pending_files.append(path)
+    skipped = len(all_files_to_process) - len(pending_files)
+    if skipped:
+        print(f"Skipping {skipped} file(s) already present in the output folder.")
+    all_files_to_process = pending_files
+
+    # Non-video files are copied in bulk up front; if tar isn't usable they
+    # go through the worker pool like everything else.
+    other_files = [
+        path
+        for path in all_files_to_process
+        if not path.lower().endswith(VIDEO_EXTENSIONS)
     ]
+    if other_files and copy_with_tar(other_files, root_input, root_output):
+        tqdm.write(f"Copied {len(other_files)} non-video file(s) directly.")
+        copied = set(other_files)
+        all_files_to_process = [
+            path for path in all_files_to_process if path not in copied
+        ]
 
-    # Process each file with a tqdm progress bar
-    for input_path in tqdm(
-        all_files_to_process, desc="Processing files", unit="file", ncols=100
-    ):
-        relative_path = os.path.relpath(input_path, root_input)
-        output_path = os.path.join(root_output, relative_path)
-
-        # Ensure the output directory for the current file exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        # Check if the file is a video
-        if input_path.lower().endswith(VIDEO_EXTENSIONS):
-            codec, bit_rate = get_video_info(input_path)
-
-            # --- Intelligent Decision Logic ---
-            # Condition 1: Is the video already AV1?
-            # Condition 2: Is the bitrate too low to be worth re-encoding?
-            if codec == "av1" or (0 < bit_rate < BITRATE_THRESHOLD):
-                tqdm.write(
-                    f"Copying (already efficient): {os.path.basename(input_path)}"
-                )
-                try:
-                    shutil.copy2(input_path, output_path)
-                except Exception as e:
-                    print(f"\n[ERROR] Could not copy {input_path}: {e}")
-            else:
-                # If conditions are not met, it's worth compressing
-                compress_video_av1(input_path, output_path, use_gpu=use_gpu)
-        else:
-            # It's not a video file, so just copy it directly
-            try:
-                shutil.copy2(input_path, output_path)
-            except Exception as e:
-                print(f"\n[ERROR] Could not copy {input_path}: {e}")
+    # Probe every video up front in parallel; ffprobe is mostly process
+    # startup and I/O, so threads overlap it well.
+    video_files = [
+        path for path in all_files_to_process if path.lower().endswith(VIDEO_EXTENSIONS)
+    ]
+    video_infos = {}
+    if video_files:
+        with ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4, len(video_files))
+        ) as executor:
+            video_infos = dict(
+                zip(video_files, executor.map(get_video_info, video_files))
+            )
+
+    if use_gpu:
+        workers = GPU_WORKERS
+    else:
+        workers = max(1, (os.cpu_count() or 1) // SVT_THREADS)
+
+    # Long CPU encodes are held back and run one at a time afterwards, each
+    # spreading its segments over all the workers.
+    long_files = []
+    if not use_gpu and workers > 1:
+        long_files = [
+            path
+            for path in video_files
+            if video_infos[path][2] > SEGMENT_THRESHOLD_SECONDS
+        ]
+    long_set = set(long_files)
+    pooled_files = [path for path in all_files_to_process if path not in long_set]
+
+    with tqdm(
+        total=len(all_files_to_process),
+        desc="Processing files",
+        unit="file",
+        ncols=100,
+    ) as progress:
+        # Each file is independent, so the pool turns the sum of all encode
+        # times into roughly that sum divided by the worker count.
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                process_single_file,
+                pooled_files,
+                repeat(root_input),
+                repeat(root_output),
+                repeat(use_gpu),
+                [video_infos.get(path) for path in pooled_files],
+            )
+            for _ in results:
+                progress.update()
+
+        for path in long_files:
+            process_single_file(
+                path, root_input, root_output, use_gpu, video_infos[path], workers
+            )
+            progress.update()
 
 
 if __name__ == "__main__":
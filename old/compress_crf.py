@@ -3,8 +3,17 @@ import subprocess
 import shutil
 import json
 import sys
-import time
 import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows; fast_copy skips reflinks there.
 
 # --- Configuration ---
 input_folder = "input"
@@ -22,6 +31,25 @@ BITRATE_THRESHOLD = 2_000_000
 # Audio setting. 'copy' is fastest and avoids re-encoding.
 AUDIO_CODEC = "copy"
 
+# Linux ioctl that clones one file's extents into another (a reflink copy).
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+# Extra renditions encoded from the same decode pass as the main output, as
+# (suffix, crf, resize) tuples. E.g. [("_720p", 30, (1280, 720))] also writes
+# "name_720p.mp4" next to every compressed "name.mp4".
+EXTRA_RENDITIONS = []
+# Number of upcoming files whose data is read into the page cache while the
+# current one is processed. Helps most on HDDs and network shares.
+PREFETCH_DEPTH = 2
+# Only the head of each upcoming file is read ahead; a whole multi-GB video
+# would push the current file's pages out of the cache.
+PREFETCH_BYTES = 256 * 1024 * 1024
+
+# --- Command Templates ---
+# Arguments that never change between files, built once.
+# Decoded frames stay in VRAM through scale_cuda and into NVENC.
+GPU_INPUT_ARGS = ("ffmpeg", "-hwaccel", "cuda", "-hwaccel_output_format", "cuda")
+PROGRESS_ARGS = ("-progress", "pipe:1", "-nostats", "-loglevel", "error")
+
 
 def get_video_details(file_path):
     """Uses ffprobe to get codec, bitrate, and total frame count."""
@@ -31,27 +59,29 @@ def get_video_details(file_path):
         "quiet",
         "-print_format",
         "json",
-        "-show_streams",
         "-select_streams",
         "v:0",
+        "-show_entries",
+        "stream=codec_name,bit_rate,nb_frames,duration,avg_frame_rate"
+        ":format=duration",
         file_path,
     ]
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        stream = json.loads(result.stdout)["streams"][0]
+        result = subprocess.run(
+            command, stdin=subprocess.DEVNULL, capture_output=True, check=True
+        )
+        info = json.loads(result.stdout)
+        stream = info["streams"][0]
         codec = stream.get("codec_name")
         bit_rate = int(stream.get("bit_rate", 0))
 
         # Get total frames for progress calculation
         total_frames = int(stream.get("nb_frames", 0))
-        if total_frames == 0 and "duration" in stream and "avg_frame_rate" in stream:
-            duration = float(stream["duration"])
-            frame_rate_str = stream["avg_frame_rate"]
-            if "/" in frame_rate_str:
-                num, den = map(int, frame_rate_str.split("/"))
-                if den != 0:
-                    frame_rate = num / den
-                    total_frames = int(duration * frame_rate)
+        duration = stream.get("duration") or info.get("format", {}).get("duration")
+        frame_rate = stream.get("avg_frame_rate", "0/0")
+        if total_frames == 0 and duration and not frame_rate.endswith("/0"):
+            # Exact fractions keep long files from drifting by a few frames.
+            total_frames = int(Fraction(duration) * Fraction(frame_rate))
 
         return codec, bit_rate, total_frames
     except Exception:
@@ -59,149 +89,415 @@ def get_video_details(file_path):
         return None, 0, 0
 
 
+def fast_copy(src, dst):
+    """
+    Copies a file and its metadata, trying a reflink first, then an in-kernel
+    sendfile loop, and finally a plain buffered copy.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        copied = False
+        if fcntl is not None:
+            # On Btrfs/XFS a reflink shares the data blocks, so any size is O(1).
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                copied = True
+            except OSError:
+                pass
+        if not copied and hasattr(os, "sendfile"):
+            try:
+                offset = 0
+                while True:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, 1 << 20)
+                    if sent == 0:
+                        break
+                    offset += sent
+                copied = True
+            except OSError:
+                fdst.seek(0)
+                fdst.truncate()
+        if not copied:
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+
+
+def fallback_link(src, dst):
+    """
+    Puts the original file in place of a failed encode. A hard link costs no
+    space when both trees share a filesystem; otherwise it is copied.
+    """
+    try:
+        os.remove(dst)  # Drop any partial ffmpeg output first.
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        # EXDEV across filesystems, or no hard link support.
+        fast_copy(src, dst)
+
+
+def drain_stream(pipe, lines):
+    """Reads a pipe until EOF, keeping only the most recent lines."""
+    for line in pipe:
+        lines.append(line)
+    pipe.close()
+
+
+def iter_progress_blocks(pipe):
+    """Yields each complete `-progress` block ffmpeg writes to the pipe as a dict."""
+    block = {}
+    for line in pipe:
+        key, _, value = line.strip().partition("=")
+        block[key] = value
+        # Every block ends with a "progress=continue|end" line.
+        if key == "progress":
+            yield block
+            block = {}
+
+
+def rendition_path(output_file, suffix):
+    """Returns the output path of an extra rendition, e.g. "a.mp4" -> "a_720p.mp4"."""
+    base, ext = os.path.splitext(output_file)
+    return f"{base}{suffix}{ext}"
+
+
+def partial_path(output_file):
+    """
+    Temporary name an encode is written under, e.g. "a.mp4" -> "a.part.mp4".
+    The real extension stays last so ffmpeg still picks the right muxer.
+    """
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.part{ext}"
+
+
+@lru_cache(maxsize=None)
+def output_args(crf):
+    """Encoder and stream options for one output file, built once per crf."""
+    return (
+        "-c:v",
+        "hevc_nvenc",
+        "-preset",
+        GPU_PRESET,
+        "-rc",
+        "vbr",
+        "-cq",
+        str(crf),
+        "-b:v",
+        "0",
+        "-c:a",
+        AUDIO_CODEC,
+        "-sn",  # <-- KEY ADDITION: Strips subtitle streams
+    )
+
+
 def compress_video_gpu(
-    input_file, output_file, total_frames, relative_path, crf=26, resize=None
+    input_file,
+    output_file,
+    total_frames,
+    relative_path,
+    crf=26,
+    resize=None,
+    extra_renditions=(),
 ):
     """
     Compresses a video using NVENC and displays real-time progress.
     Now with better error handling and subtitle stripping.
+    Extra renditions share the single decode, each with its own encoder.
+    Every output is written under a partial name and only renamed into place
+    once ffmpeg succeeds, so a failed run leaves no truncated renditions.
     """
-    progress_file_path = ""
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, mode="w+", suffix=".txt") as tmp:
-            progress_file_path = tmp.name
-
-        command = [
-            "ffmpeg",
-            "-hwaccel",
-            "cuda",
-            "-i",
-            input_file,
-            "-c:v",
-            "hevc_nvenc",
-            "-preset",
-            GPU_PRESET,
-            "-rc",
-            "vbr",
-            "-cq",
-            str(crf),
-            "-b:v",
-            "0",
-            "-c:a",
-            AUDIO_CODEC,
-            "-sn",  # <-- KEY ADDITION: Strips subtitle streams
-            "-y",
-            "-progress",
-            progress_file_path,
-            "-loglevel",
-            "error",
-            output_file,
-        ]
+    outputs = [(output_file, crf, resize)] + [
+        (rendition_path(output_file, suffix), r_crf, r_resize)
+        for suffix, r_crf, r_resize in extra_renditions
+    ]
+    command = [*GPU_INPUT_ARGS, "-i", input_file]
+    if len(outputs) == 1:
         if resize:
             width, height = resize
-            command.insert(-2, "-vf")
-            command.insert(-2, f"scale_cuda={width}:{height}")
-
-        # Start the ffmpeg process, now capturing stderr
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",
-        )
-
-        # Monitor progress file (same as before)
-        while process.poll() is None:
-            time.sleep(0.5)
+            command.extend(["-vf", f"scale_cuda={width}:{height}"])
+        command.extend(output_args(crf))
+        command.append("-y")
+    else:
+        # Split the decoded video once and scale each branch as needed.
+        labels = [f"v{n}" for n in range(len(outputs))]
+        graph = [f"[0:v]split={len(outputs)}" + "".join(f"[{l}]" for l in labels)]
+        for n, (_, _, out_resize) in enumerate(outputs):
+            if out_resize:
+                width, height = out_resize
+                graph.append(f"[v{n}]scale_cuda={width}:{height}[s{n}]")
+                labels[n] = f"s{n}"
+        command.extend(["-filter_complex", ";".join(graph), "-y"])
+        for (path, out_crf, _), label in zip(outputs[1:], labels[1:]):
+            command.extend(["-map", f"[{label}]", "-map", "0:a?"])
+            command.extend(output_args(out_crf))
+            command.append(partial_path(path))
+        command.extend(["-map", f"[{labels[0]}]", "-map", "0:a?"])
+        command.extend(output_args(crf))
+    command.extend(PROGRESS_ARGS)
+    command.append(partial_path(output_file))
+
+    # Progress arrives on stdout as ffmpeg writes it; stderr is captured
+    # separately for error reporting.
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        bufsize=1 << 20,
+    )
+    # Drain stderr as it arrives so a chatty ffmpeg can't fill the pipe
+    # buffer and stall, while keeping the tail for error reporting.
+    err_lines = deque(maxlen=200)
+    stderr_reader = threading.Thread(
+        target=drain_stream, args=(process.stderr, err_lines), daemon=True
+    )
+    stderr_reader.start()
+
+    for progress_data in iter_progress_blocks(process.stdout):
+        if total_frames > 0 and "frame" in progress_data:
             try:
-                with open(progress_file_path, "r") as f:
-                    f.seek(0, os.SEEK_END)
-                    if f.tell() == 0:
-                        continue
-                    f.seek(max(0, f.tell() - 512))
-                    lines = f.readlines()
-
-                progress_data = {}
-                for line in lines[-12:]:
-                    if "=" in line:
-                        key, value = line.strip().split("=", 1)
-                        progress_data[key] = value
-
-                if total_frames > 0 and "frame" in progress_data:
-                    current_frame = int(progress_data["frame"])
-                    percent = (current_frame / total_frames) * 100
-                    fps = progress_data.get("fps", "0.0")
-                    bitrate = progress_data.get("bitrate", "N/A")
-                    progress_text = (
-                        f"[GPU] [{percent:3.1f}%] "
-                        f"Encoding {relative_path} ({fps}fps @ {bitrate})"
-                    )
-                    sys.stdout.write(f"\r{progress_text}")
-                    sys.stdout.flush()
-            except (FileNotFoundError, IndexError):
+                current_frame = int(progress_data["frame"])
+            except ValueError:
                 continue
+            percent = (current_frame / total_frames) * 100
+            fps = progress_data.get("fps", "0.0")
+            bitrate = progress_data.get("bitrate", "N/A")
+            progress_text = (
+                f"[GPU] [{percent:3.1f}%] "
+                f"Encoding {relative_path} ({fps}fps @ {bitrate})"
+            )
+            sys.stdout.write(f"\r{progress_text}")
+            sys.stdout.flush()
+
+    sys.stdout.write("\r" + " " * 120 + "\r")
+    sys.stdout.flush()
+
+    # Check for errors and print them
+    process.wait()
+    stderr_reader.join()
+    if process.returncode != 0:
+        stderr = "".join(err_lines).strip()
+        print(f"[ERROR] FFmpeg failed on {relative_path}.")
+        print("--- FFmpeg Error Output ---")
+        print(stderr if stderr else "No error output captured.")
+        print("---------------------------")
+        print("Copying original file instead.")
+        for path, _, _ in outputs:
+            try:
+                os.remove(partial_path(path))
+            except FileNotFoundError:
+                pass
+        fallback_link(input_file, output_file)
+        return
+    for path, _, _ in outputs:
+        os.replace(partial_path(path), path)
+
+
+def iter_files(root):
+    """Yields the path of every file under root, walking it with os.scandir."""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+
+def advise_file(path, advice, length=0):
+    """
+    Passes a posix_fadvise hint for the first length bytes of a file (0 means
+    the whole file), ignoring failures.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, length, advice)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def prefetch_files(paths):
+    """Asks the kernel to start reading the files into the page cache."""
+    for path in paths:
+        # The cached pages outlive the descriptor; SEQUENTIAL would not, as it
+        # only applies to the descriptor it is set on.
+        advise_file(path, os.POSIX_FADV_WILLNEED, PREFETCH_BYTES)
+
+
+def output_path_for(input_path, root_input, root_output):
+    """Maps an input file to its output path, saving .m4v as .mp4."""
+    relative_path_without_ext, original_ext = os.path.splitext(
+        os.path.relpath(input_path, root_input)
+    )
+    output_ext = ".mp4" if original_ext.lower() == ".m4v" else original_ext
+    return os.path.join(root_output, relative_path_without_ext + output_ext)
 
-        sys.stdout.write("\r" + " " * 120 + "\r")
-        sys.stdout.flush()
 
-        # Check for errors and print them
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
-            print(f"[ERROR] FFmpeg failed on {relative_path}.")
-            print("--- FFmpeg Error Output ---")
-            print(stderr if stderr else "No error output captured.")
-            print("---------------------------")
-            print("Copying original file instead.")
-            shutil.copy2(input_file, output_file)
+def copy_into_place(src, dst):
+    """Copies src under a temporary name and renames it to dst once complete."""
+    part_path = partial_path(dst)
+    try:
+        fast_copy(src, part_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.replace(part_path, dst)
+
+
+def expected_outputs(input_path, root_input, root_output, extra_renditions):
+    """Every output path a finished input leaves behind."""
+    output_path = output_path_for(input_path, root_input, root_output)
+    if not input_path.lower().endswith(VIDEO_EXTENSIONS):
+        return [output_path]
+    return [output_path] + [
+        rendition_path(output_path, suffix) for suffix, _, _ in extra_renditions
+    ]
+
+
+def make_output_tree(files, root_input, root_output):
+    """Creates every output directory the files need, once per directory."""
+    for relative_dir in {
+        os.path.dirname(os.path.relpath(p, root_input)) for p in files
+    }:
+        os.makedirs(os.path.join(root_output, relative_dir), exist_ok=True)
 
+
+def copy_with_tar(files, root_input, root_output):
+    """
+    Copies files from root_input to the same relative paths under root_output
+    through one tar pipe instead of a copy per file. Returns True on success.
+    The archive is unpacked into a staging directory and each file is renamed
+    into place afterwards, so a failed tar leaves no truncated outputs behind.
+    """
+    tar = shutil.which("tar")
+    if tar is None:
+        return False
+    # "./" keeps names starting with "-" from being read as tar options.
+    names = b"".join(
+        os.fsencode(os.path.join(".", os.path.relpath(path, root_input))) + b"\0"
+        for path in files
+    )
+    staging_dir = tempfile.mkdtemp(prefix=".tar_", dir=root_output)
+    try:
+        pack = subprocess.Popen(
+            [tar, "-C", root_input, "--null", "-T", "-", "-cf", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        unpack = subprocess.Popen(
+            [tar, "-C", staging_dir, "--no-same-owner", "-xf", "-"],
+            stdin=pack.stdout,
+        )
+        pack.stdout.close()  # Only unpack reads the archive.
+        pack.stdin.write(names)
+        pack.stdin.close()
+        if pack.wait() != 0 or unpack.wait() != 0:
+            return False
+        for path in files:
+            relative_path = os.path.relpath(path, root_input)
+            os.replace(
+                os.path.join(staging_dir, relative_path),
+                os.path.join(root_output, relative_path),
+            )
+        return True
+    except OSError:
+        return False
     finally:
-        if os.path.exists(progress_file_path):
-            os.remove(progress_file_path)
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
 
-def process_files_recursively(root_input, root_output, crf=26, resize=None):
+def process_files_recursively(
+    root_input, root_output, crf=26, resize=None, extra_renditions=()
+):
     """
     Recursively scans files, changing .m4v to .mp4 on output,
     and preserving all other extensions.
     """
-    all_files_to_process = [
-        os.path.join(dp, f) for dp, dn, fn in os.walk(root_input) for f in fn
+    all_files_to_process = list(iter_files(root_input))
+    make_output_tree(all_files_to_process, root_input, root_output)
+
+    # Drop finished files first so they are neither probed nor prefetched. A
+    # video also needs its renditions, so a failed encode is retried.
+    pending_files = [
+        path
+        for path in all_files_to_process
+        if not all(
+            os.path.exists(output_path)
+            for output_path in expected_outputs(
+                path, root_input, root_output, extra_renditions
+            )
+        )
+    ]
+    if len(pending_files) < len(all_files_to_process):
+        print(
+            f"Skipping {len(all_files_to_process) - len(pending_files)} file(s) "
+            "whose output already exists."
+        )
+    all_files_to_process = pending_files
+
+    # Non-video files are copied in bulk up front; anything tar can't handle
+    # stays in the per-file loop below.
+    other_files = [
+        path
+        for path in all_files_to_process
+        if not path.lower().endswith(VIDEO_EXTENSIONS)
     ]
+    if other_files and copy_with_tar(other_files, root_input, root_output):
+        print(f"Copied {len(other_files)} non-video file(s) directly.")
+        copied = set(other_files)
+        all_files_to_process = [
+            path for path in all_files_to_process if path not in copied
+        ]
     total_files = len(all_files_to_process)
 
+    # Probe every video up front in parallel; ffprobe is mostly process
+    # startup and I/O, so threads overlap it well.
+    video_files = [
+        path for path in all_files_to_process if path.lower().endswith(VIDEO_EXTENSIONS)
+    ]
+    video_details = {}
+    if video_files:
+        with ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4, len(video_files))
+        ) as executor:
+            video_details = dict(
+                zip(video_files, executor.map(get_video_details, video_files))
+            )
+
+    can_prefetch = hasattr(os, "posix_fadvise") and PREFETCH_DEPTH > 0
     for i, input_path in enumerate(all_files_to_process):
-        relative_path = os.path.relpath(input_path, root_input)
-
-        # --- START OF MODIFICATION ---
-        # Get the original filename and extension
-        relative_path_without_ext, original_ext = os.path.splitext(relative_path)
-
-        # Decide the output extension based on the original
-        output_ext = ".mp4" if original_ext.lower() == ".m4v" else original_ext
+        if can_prefetch:
+            if i > 0:
+                # The previous file is done; free its pages for the next ones.
+                advise_file(all_files_to_process[i - 1], os.POSIX_FADV_DONTNEED)
+            upcoming = all_files_to_process[i + 1 : i + 1 + PREFETCH_DEPTH]
+            threading.Thread(
+                target=prefetch_files, args=(upcoming,), daemon=True
+            ).start()
 
-        # Construct the new output path with the correct extension
-        output_relative_path = relative_path_without_ext + output_ext
-        output_path = os.path.join(root_output, output_relative_path)
-        # --- END OF MODIFICATION ---
+        relative_path = os.path.relpath(input_path, root_input)
+        output_path = output_path_for(input_path, root_input, root_output)
 
         print(f"\n--- Processing file {i + 1} of {total_files}: {relative_path} ---")
 
-        if os.path.exists(output_path):
-            print("Output file already exists. Skipping.")
-            continue
-
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
         # Process video files
         if input_path.lower().endswith(VIDEO_EXTENSIONS):
-            codec, bit_rate, total_frames = get_video_details(input_path)
+            codec, bit_rate, total_frames = video_details[input_path]
 
             # This condition handles videos that are already efficient and should just be copied.
             # Even when copying a .m4v, we save it as a more compatible .mp4.
             if codec == "hevc" or (0 < bit_rate < BITRATE_THRESHOLD):
-                print(f"Video is already efficient. Copying to {output_path}...")
-                shutil.copy2(input_path, output_path)
+                # Efficient videos get no renditions, so an existing copy is done.
+                if not os.path.exists(output_path):
+                    print(f"Video is already efficient. Copying to {output_path}...")
+                    copy_into_place(input_path, output_path)
             else:
                 print(f"Video requires compression. Encoding to {output_path}...")
                 compress_video_gpu(
@@ -211,14 +507,18 @@ def process_files_recursively(root_input, root_output, crf=26, resize=None):
                     relative_path,
                     crf=crf,
                     resize=resize,
+                    extra_renditions=extra_renditions,
                 )
         # Directly copy non-video files
         else:
             print("Not a video file. Copying directly...")
-            shutil.copy2(input_path, output_path)
+            copy_into_place(input_path, output_path)
 
         print("Finished processing file.")
 
+    if can_prefetch and all_files_to_process:
+        advise_file(all_files_to_process[-1], os.POSIX_FADV_DONTNEED)
+
 
 if __name__ == "__main__":
     crf_value = H265_CRF
@@ -231,7 +531,11 @@ if __name__ == "__main__":
 
     try:
         process_files_recursively(
-            input_folder, output_folder, crf=crf_value, resize=resize_to
+            input_folder,
+            output_folder,
+            crf=crf_value,
+            resize=resize_to,
+            extra_renditions=EXTRA_RENDITIONS,
         )
         print("\nProcessing complete.")
     except KeyboardInterrupt:
@@ -5,172 +5,327 @@ import json
 import multiprocessing
 import time
 import sys
-import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from queue import Empty
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows; fast_copy skips reflinks there.
 
 # --- Main Configuration ---
 # Set the number of CPU cores you want to use for encoding.
 # The script will use these IN ADDITION to the GPU, if available.
 CPU_WORKERS = 1
+# Number of files encoded at once on the GPU. None probes how many NVENC
+# sessions the driver allows (up to GPU_WORKERS_MAX) at startup.
+GPU_WORKERS = None
+GPU_WORKERS_MAX = 4
 
 # --- H.265 (HEVC) Encoding Settings ---
 H265_CRF = 25
 CPU_PRESET = "medium"
 GPU_PRESET = "p6"
 BITRATE_THRESHOLD = 2_000_000
+# Videos spending fewer bits per pixel per frame than this are already about
+# as small as HEVC at H265_CRF would make them, so they are copied whatever
+# their codec or resolution.
+BPP_THRESHOLD = 0.05
 AUDIO_CODEC = "copy"
 
 # --- Script Behavior ---
 input_folder = "input"
 output_folder = "output"
 VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv", ".wmv")
+# Progress lines are redrawn at most this often (seconds).
+UI_REFRESH_SECONDS = 0.1
+
+# --- Command Templates ---
+# Everything but the input and output paths is fixed for the whole run, so the
+# ffmpeg arguments are built once here and only the paths are added per file.
+GPU_INPUT_ARGS = (
+    "ffmpeg",
+    "-hwaccel",
+    "cuda",
+    "-hwaccel_output_format",
+    "cuda",
+    "-i",
+)
+GPU_ENCODE_ARGS = (
+    "-c:v",
+    "hevc_nvenc",
+    "-preset",
+    GPU_PRESET,
+    "-rc",
+    "vbr",
+    "-cq",
+    str(H265_CRF),
+    "-b:v",
+    "0",
+)
+CPU_INPUT_ARGS = ("ffmpeg", "-i")
+CPU_ENCODE_ARGS = ("-c:v", "libx265", "-crf", str(H265_CRF), "-preset", CPU_PRESET)
+OUTPUT_ARGS = (
+    "-c:a",
+    AUDIO_CODEC,
+    "-y",
+    "-progress",
+    "pipe:1",
+    "-nostats",
+    "-loglevel",
+    "error",
+)
+
+# Encoder probe results, keyed by the ffmpeg binary so upgrades are re-probed.
+ENCODER_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "video_compressor",
+    "encoders.json",
+)
+
+# Linux ioctl that clones one file's extents into another (a reflink copy).
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
 
 
 def get_video_details(file_path):
-    """Uses ffprobe to get codec, bitrate, and total frame count."""
+    """
+    Uses ffprobe to get codec, bitrate, total frame count, width, height and
+    frame rate.
+    """
     command = [
         "ffprobe",
         "-v",
         "quiet",
         "-print_format",
         "json",
-        "-show_streams",
         "-select_streams",
         "v:0",
+        "-show_entries",
+        "stream=codec_name,bit_rate,nb_frames,duration,avg_frame_rate,width,height"
+        ":format=duration",
         file_path,
     ]
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        stream = json.loads(result.stdout)["streams"][0]
+        result = subprocess.run(
+            command, stdin=subprocess.DEVNULL, capture_output=True, check=True
+        )
+        info = json.loads(result.stdout)
+        stream = info["streams"][0]
         codec = stream.get("codec_name")
         bit_rate = int(stream.get("bit_rate", 0))
         # Total frames can be in 'nb_frames' or calculated from duration/avg_frame_rate
         total_frames = int(stream.get("nb_frames", 0))
-        if total_frames == 0 and "duration" in stream and "avg_frame_rate" in stream:
-            duration = float(stream["duration"])
-            frame_rate_str = stream["avg_frame_rate"]
-            if "/" in frame_rate_str:
-                num, den = map(int, frame_rate_str.split("/"))
-                if den != 0:
-                    frame_rate = num / den
-                    total_frames = int(duration * frame_rate)
-        return codec, bit_rate, total_frames
+        duration = stream.get("duration") or info.get("format", {}).get("duration")
+        frame_rate = stream.get("avg_frame_rate", "0/0")
+        fps = Fraction(frame_rate) if not frame_rate.endswith("/0") else 0
+        if total_frames == 0 and duration and fps:
+            # Exact fractions keep long files from drifting by a few frames.
+            total_frames = int(Fraction(duration) * fps)
+        width = int(stream.get("width", 0))
+        height = int(stream.get("height", 0))
+        return codec, bit_rate, total_frames, width, height, float(fps)
     except Exception:
-        return None, 0, 0
+        return None, 0, 0, 0, 0, 0.0
+
+
+def bits_per_pixel(bit_rate, width, height, fps):
+    """Average bits spent on each pixel of each frame, or 0 if unknown."""
+    if not (bit_rate and width and height and fps):
+        return 0
+    return bit_rate / (width * height * fps)
 
 
-def update_progress_line(line_num, text):
-    """Updates a specific line in the console using ANSI escape codes."""
-    sys.stdout.write(f"\x1b[{line_num};0H")  # Move cursor to line
-    sys.stdout.write(f"\x1b[2K")  # Clear entire line
-    sys.stdout.write(text)
+def fast_copy(src, dst):
+    """
+    Copies a file and its metadata, trying a reflink first, then an in-kernel
+    sendfile loop, and finally a plain buffered copy.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        copied = False
+        if fcntl is not None:
+            # On Btrfs/XFS a reflink shares the data blocks, so any size is O(1).
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                copied = True
+            except OSError:
+                pass
+        if not copied and hasattr(os, "sendfile"):
+            try:
+                offset = 0
+                while True:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, 1 << 20)
+                    if sent == 0:
+                        break
+                    offset += sent
+                copied = True
+            except OSError:
+                fdst.seek(0)
+                fdst.truncate()
+        if not copied:
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+
+
+def fallback_link(src, dst):
+    """
+    Puts the original file in place of a failed encode. A hard link costs no
+    space when both trees share a filesystem; otherwise it is copied.
+    """
+    try:
+        os.remove(dst)  # Drop any partial ffmpeg output first.
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        # EXDEV across filesystems, or no hard link support.
+        fast_copy(src, dst)
+
+
+def format_progress(message):
+    """Renders a worker's progress message as its console line."""
+    if message.get("pct") is None:
+        return ""
+    return (
+        f"[{message['worker']}][{message['pct']:3.1f}%] "
+        f"Encoding {message['file']} ({message['fps']}fps, {message['br']})"
+    )
+
+
+def draw_progress_lines(lines):
+    """Rewrites the given {line number: text} slots, then restores the cursor."""
+    sys.stdout.write("\x1b[s")  # Save cursor position
+    for line_num, text in sorted(lines.items()):
+        sys.stdout.write(f"\x1b[{line_num};0H\x1b[2K{text}")
+    sys.stdout.write("\x1b[u")  # Restore cursor position
     sys.stdout.flush()
 
 
+def ui_loop(progress_queue, num_slots):
+    """
+    The only writer to the console. Workers send progress and log messages
+    through progress_queue; None stops the loop.
+    """
+    pending = {}
+    last_draw = 0.0
+    while True:
+        try:
+            message = progress_queue.get(timeout=UI_REFRESH_SECONDS)
+        except Empty:
+            message = {}
+        if message is None:
+            break
+        if "log" in message:
+            sys.stdout.write(f"\x1b[{num_slots + 2};0H{message['log']}\n")
+            sys.stdout.flush()
+        elif "slot" in message:
+            pending[message["slot"]] = format_progress(message)
+
+        now = time.monotonic()
+        if pending and now - last_draw >= UI_REFRESH_SECONDS:
+            draw_progress_lines(pending)
+            pending.clear()
+            last_draw = now
+    if pending:
+        draw_progress_lines(pending)
+
+
+def drain_stream(pipe, lines):
+    """Reads a pipe until EOF, keeping only the most recent lines."""
+    for line in pipe:
+        lines.append(line)
+    pipe.close()
+
+
+def iter_progress_blocks(pipe):
+    """Yields each complete `-progress` block ffmpeg writes to the pipe as a dict."""
+    block = {}
+    for line in pipe:
+        key, _, value = line.strip().partition("=")
+        block[key] = value
+        # Every block ends with a "progress=continue|end" line.
+        if key == "progress":
+            yield block
+            block = {}
+
+
 def compress_video_h265(input_file, output_file, total_frames, use_gpu, slot):
     """Compresses a video while monitoring and displaying real-time progress."""
-    progress_file_path = ""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, mode="w+", suffix=".txt") as tmp:
-            progress_file_path = tmp.name
-
         if use_gpu:
-            command = [
-                "ffmpeg",
-                "-hwaccel",
-                "cuda",
-                "-i",
-                input_file,
-                "-c:v",
-                "hevc_nvenc",
-                "-preset",
-                GPU_PRESET,
-                "-rc",
-                "vbr",
-                "-cq",
-                str(H265_CRF),
-                "-b:v",
-                "0",
-                "-c:a",
-                AUDIO_CODEC,
-                "-y",
-                "-progress",
-                progress_file_path,
-                "-loglevel",
-                "error",
-                output_file,
-            ]
+            input_args, encode_args = GPU_INPUT_ARGS, GPU_ENCODE_ARGS
         else:
-            command = [
-                "ffmpeg",
-                "-i",
-                input_file,
-                "-c:v",
-                "libx265",
-                "-crf",
-                str(H265_CRF),
-                "-preset",
-                CPU_PRESET,
-                "-c:a",
-                AUDIO_CODEC,
-                "-y",
-                "-progress",
-                progress_file_path,
-                "-loglevel",
-                "error",
-                output_file,
-            ]
+            input_args, encode_args = CPU_INPUT_ARGS, CPU_ENCODE_ARGS
+        command = [*input_args, input_file, *encode_args, *OUTPUT_ARGS, output_file]
 
+        # Progress arrives on stdout as ffmpeg writes it, with no temp file.
         process = subprocess.Popen(
-            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1 << 20,
+        )
+        # Keep the tail of stderr in memory so failures can be reported without
+        # risking a pipe-buffer stall.
+        err_lines = deque(maxlen=200)
+        stderr_reader = threading.Thread(
+            target=drain_stream, args=(process.stderr, err_lines), daemon=True
         )
+        stderr_reader.start()
 
-        # Monitor progress
-        while process.poll() is None:
-            time.sleep(0.5)
+        worker_type = "GPU" if use_gpu else "CPU"
+        for progress_data in iter_progress_blocks(process.stdout):
+            if total_frames <= 0 or "frame" not in progress_data:
+                continue
             try:
-                with open(progress_file_path, "r") as f:
-                    lines = f.readlines()
-                progress_data = {}
-                for line in lines:
-                    if "=" in line:
-                        key, value = line.strip().split("=", 1)
-                        progress_data[key] = value
-
-                if total_frames > 0 and "frame" in progress_data:
-                    current_frame = int(progress_data["frame"])
-                    percent = (current_frame / total_frames) * 100
-                    fps = progress_data.get("fps", "0.0")
-                    bitrate = progress_data.get("bitrate", "N/A")
-                    worker_type = "GPU" if use_gpu else "CPU"
-
-                    progress_text = (
-                        f"[{worker_type}][{percent:3.1f}%] "
-                        f"Encoding {os.path.basename(input_file)} "
-                        f"({fps}fps, {bitrate})"
-                    )
-                    update_progress_line(slot, progress_text)
-
-            except FileNotFoundError:
-                continue  # Progress file might not be created yet
-            except Exception:
+                current_frame = int(progress_data["frame"])
+            except ValueError:
                 continue  # Ignore parsing errors
+            progress_queue.put(
+                {
+                    "slot": slot,
+                    "worker": worker_type,
+                    "pct": (current_frame / total_frames) * 100,
+                    "fps": progress_data.get("fps", "0.0"),
+                    "br": progress_data.get("bitrate", "N/A"),
+                    "file": os.path.basename(input_file),
+                }
+            )
 
+        process.wait()
+        stderr_reader.join()
         if process.returncode != 0:
+            error_output = "".join(err_lines).strip() or "No error output captured."
+            progress_queue.put(
+                {
+                    "log": f"[ERROR] FFmpeg failed on "
+                    f"{os.path.basename(input_file)}:\n{error_output}"
+                }
+            )
             # Fallback copy if ffmpeg fails
-            shutil.copy2(input_file, output_file)
+            fallback_link(input_file, output_file)
 
     finally:
-        if os.path.exists(progress_file_path):
-            os.remove(progress_file_path)
         # Clear the progress line when done
-        update_progress_line(slot, "")
+        progress_queue.put({"slot": slot, "pct": None})
 
 
-def init_worker(lock, num_slots):
+def init_worker(queue, sem, slot_counter, cpu_allowed):
     """Initializer for each worker process."""
-    global print_lock, total_slots
-    print_lock = lock
-    total_slots = num_slots
+    global progress_queue, gpu_sem, worker_slot, cpu_fallback
+    progress_queue = queue
+    gpu_sem = sem
+    cpu_fallback = cpu_allowed
+    # Each worker owns one progress line for its whole lifetime.
+    with slot_counter.get_lock():
+        slot_counter.value += 1
+        worker_slot = slot_counter.value
     import signal
 
     signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -178,9 +333,9 @@ def init_worker(lock, num_slots):
 
 def process_single_file(args):
     """Worker function to process one file."""
-    input_path, use_gpu, slot = args
+    input_path, details = args
     pid = os.getpid()
-    worker_type = "GPU" if use_gpu else "CPU"
+    worker_type = "CPU"
     filename = os.path.basename(input_path)
 
     relative_path = os.path.relpath(input_path, input_folder)
@@ -189,27 +344,42 @@ def process_single_file(args):
     if os.path.exists(output_path):
         return "skipped"
 
-    log_message = f"[{worker_type} PID: {pid}] Starting: {filename}"
-    with print_lock:
-        sys.stdout.write(f"\x1b[{total_slots + 2};0H{log_message}\n")
+    progress_queue.put({"log": f"[PID: {pid}] Starting: {filename}"})
 
     start_time = time.time()
     result_status = "error"
 
     if input_path.lower().endswith(VIDEO_EXTENSIONS):
-        codec, bit_rate, total_frames = get_video_details(input_path)
-        if codec == "hevc" or (0 < bit_rate < BITRATE_THRESHOLD):
+        codec, bit_rate, total_frames, width, height, fps = details
+        bpp = bits_per_pixel(bit_rate, width, height, fps)
+        if (
+            codec == "hevc"
+            or (0 < bit_rate < BITRATE_THRESHOLD)
+            or (0 < bpp < BPP_THRESHOLD)
+        ):
             try:
-                shutil.copy2(input_path, output_path)
+                fast_copy(input_path, output_path)
                 result_status = "copied_video"
             except Exception:
                 pass
         else:
-            compress_video_h265(input_path, output_path, total_frames, use_gpu, slot)
+            # Any worker may take the GPU while a session is free; the rest
+            # encode on the CPU instead of waiting. Without a CPU encoder,
+            # wait for the GPU.
+            use_gpu = gpu_sem is not None and gpu_sem.acquire(block=not cpu_fallback)
+            if use_gpu:
+                worker_type = "GPU"
+            try:
+                compress_video_h265(
+                    input_path, output_path, total_frames, use_gpu, worker_slot
+                )
+            finally:
+                if use_gpu:
+                    gpu_sem.release()
             result_status = "compressed"
     else:
         try:
-            shutil.copy2(input_path, output_path)
+            fast_copy(input_path, output_path)
             result_status = "copied_other"
         except Exception:
             pass
@@ -218,27 +388,127 @@ def process_single_file(args):
     duration = end_time - start_time
 
     log_message = f"[{worker_type} PID: {pid}] Finished: {filename} ({result_status}) in {duration:.2f}s"
-    with print_lock:
-        sys.stdout.write(f"\x1b[{total_slots + 2};0H{log_message}\n")
+    progress_queue.put({"log": log_message})
 
     return result_status
 
 
+def iter_files(root):
+    """Yields the path of every file under root, walking it with os.scandir."""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+
+def make_output_tree(files, root_input, root_output):
+    """Creates every output directory the files need, once per directory."""
+    for relative_dir in {
+        os.path.dirname(os.path.relpath(p, root_input)) for p in files
+    }:
+        os.makedirs(os.path.join(root_output, relative_dir), exist_ok=True)
+
+
+def ffmpeg_cache_key():
+    """Identifies the ffmpeg on PATH by location, size and mtime, or None if missing."""
+    path = shutil.which("ffmpeg")
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_encoder_cache():
+    """Reads the encoder cache, or returns an empty one."""
+    try:
+        with open(ENCODER_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_encoder_cache(cache):
+    """Writes the encoder cache, ignoring failures."""
+    try:
+        os.makedirs(os.path.dirname(ENCODER_CACHE_FILE), exist_ok=True)
+        with open(ENCODER_CACHE_FILE, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass  # The cache only saves a probe next time.
+
+
 def check_ffmpeg_encoders():
+    """Returns (has hevc_nvenc, has libx265), cached per ffmpeg binary."""
     try:
-        result = subprocess.run(
-            ["ffmpeg", "-encoders"], capture_output=True, text=True, check=True
-        )
-        return "hevc_nvenc" in result.stdout, "libx265" in result.stdout
+        key = ffmpeg_cache_key()
+        if key is None:
+            return False, False
+        cache = load_encoder_cache()
+        cached = cache.get(key, {})
+        if "hevc_nvenc" not in cached or "libx265" not in cached:
+            result = subprocess.run(
+                ["ffmpeg", "-encoders"], capture_output=True, text=True, check=True
+            )
+            cached["hevc_nvenc"] = "hevc_nvenc" in result.stdout
+            cached["libx265"] = "libx265" in result.stdout
+            cache[key] = cached
+            save_encoder_cache(cache)
+        return cached["hevc_nvenc"], cached["libx265"]
     except FileNotFoundError:
         return False, False
 
 
+def probe_nvenc_sessions(max_sessions):
+    """
+    Starts max_sessions tiny hevc_nvenc encodes at once and returns how many
+    succeed, i.e. how many NVENC sessions the driver lets this GPU open. 0
+    means hevc_nvenc is listed but can't actually open a session here.
+    """
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        "testsrc=duration=1:size=256x256:rate=30",
+        "-c:v",
+        "hevc_nvenc",
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        processes = [
+            subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            for _ in range(max_sessions)
+        ]
+    except OSError:
+        return 0
+    # Sessions over the limit fail with "OpenEncodeSessionEx failed".
+    return sum(process.wait() == 0 for process in processes)
+
+
 if __name__ == "__main__":
     has_gpu_encoder, has_cpu_encoder = check_ffmpeg_encoders()
 
     cpu_worker_count = CPU_WORKERS if has_cpu_encoder else 0
-    gpu_worker_count = 1 if has_gpu_encoder else 0
+    gpu_worker_count = 0
+    if has_gpu_encoder:
+        gpu_worker_count = GPU_WORKERS or probe_nvenc_sessions(GPU_WORKERS_MAX)
+        if gpu_worker_count == 0:
+            print(
+                "[WARN] hevc_nvenc could not open a session; no GPU workers will run."
+            )
 
     if gpu_worker_count == 0 and cpu_worker_count == 0:
         print(
@@ -246,38 +516,24 @@ if __name__ == "__main__":
         )
         sys.exit(1)
 
-    all_files = [
-        os.path.join(dp, f) for dp, dn, fn in os.walk(input_folder) for f in fn
-    ]
-
-    # Create separate GPU and CPU task lists with different slots
-
-    gpu_tasks = []
-    cpu_tasks = []
-
-    # GPU slots will be 1..gpu_worker_count
-    # CPU slots will be gpu_worker_count+1 .. total_slots
-
-    gpu_slot = 1
-    cpu_slot = gpu_worker_count + 1
+    all_files = list(iter_files(input_folder))
+    make_output_tree(all_files, input_folder, output_folder)
 
-    worker_configs = []
-    if has_gpu_encoder:
-        worker_configs.append(True)
-    for _ in range(cpu_worker_count):
-        worker_configs.append(False)
-
-    # Distribute files round-robin between GPU and CPU workers
-    for i, file_path in enumerate(all_files):
-        use_gpu = worker_configs[i % len(worker_configs)]
-        if use_gpu:
-            gpu_tasks.append((file_path, True, gpu_slot))
-        else:
-            cpu_tasks.append((file_path, False, cpu_slot))
-            cpu_slot += 1
-            if cpu_slot > gpu_worker_count + cpu_worker_count:
-                cpu_slot = gpu_worker_count + 1
+    # Probe every video up front in parallel so workers never wait on ffprobe;
+    # the details travel with each task.
+    video_files = [
+        path for path in all_files if path.lower().endswith(VIDEO_EXTENSIONS)
+    ]
+    video_details = {}
+    if video_files:
+        with ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4, len(video_files))
+        ) as executor:
+            video_details = dict(
+                zip(video_files, executor.map(get_video_details, video_files))
+            )
 
+    tasks = [(file_path, video_details.get(file_path)) for file_path in all_files]
     num_processes = gpu_worker_count + cpu_worker_count
 
     sys.stdout.write("\x1b[2J\x1b[H")
@@ -291,43 +547,38 @@ if __name__ == "__main__":
     for i in range(num_processes + 2):
         print("")
 
-    lock = multiprocessing.Manager().Lock()
     multiprocessing.set_start_method("spawn", force=True)
-
-    # Make globals available for main-process GPU calls
-    print_lock = lock
-    total_slots = num_processes
+    # Workers never touch the console; this thread draws everything they send.
+    progress_queue = multiprocessing.Queue()
+    ui_thread = threading.Thread(
+        target=ui_loop, args=(progress_queue, num_processes), daemon=True
+    )
+    ui_thread.start()
+    gpu_sem = (
+        multiprocessing.BoundedSemaphore(gpu_worker_count)
+        if gpu_worker_count > 0
+        else None
+    )
+    slot_counter = multiprocessing.Value("i", 0)
 
     results = []
 
     pool = None
     try:
-        # Start CPU pool
-        if cpu_worker_count > 0:
-            pool = multiprocessing.Pool(
-                processes=cpu_worker_count,
-                initializer=init_worker,
-                initargs=(lock, num_processes),
-            )
-            cpu_results_iter = pool.imap_unordered(
-                process_single_file,
-                cpu_tasks,
-            )
-        else:
-            cpu_results_iter = []
-
-        # Run GPU tasks serially
-        if gpu_worker_count > 0:
-            for task in gpu_tasks:
-                result = process_single_file(task)
-                results.append(result)
-
-        for res in cpu_results_iter:
+        # One pool serves every file; GPU sessions are claimed per encode
+        # through the semaphore, so neither side idles while work remains.
+        pool = multiprocessing.Pool(
+            processes=num_processes,
+            initializer=init_worker,
+            initargs=(progress_queue, gpu_sem, slot_counter, cpu_worker_count > 0),
+        )
+        for res in pool.imap_unordered(process_single_file, tasks):
             results.append(res)
 
-        if pool:
-            pool.close()
-            pool.join()
+        pool.close()
+        pool.join()
+        progress_queue.put(None)
+        ui_thread.join()
 
     except KeyboardInterrupt:
         sys.stdout.write(f"\x1b[{num_processes + 3};0H")